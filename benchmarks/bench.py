@@ -0,0 +1,269 @@
+""" Benchmarks the database and display hot paths on large task lists.
+
+    For each size, a task list is seeded in a temporary directory (never the
+    real ~/.todo.db) with a realistic mix of titles, descriptions, due dates
+    and finished tasks. Each operation is then timed end to end (including
+    preparing its input) and per stage, and run once more under tracemalloc
+    to record its peak memory:
+
+      get_tasks     - DB.get_tasks on the whole list
+      format_row    - Display.format_row on the whole list
+      print_table   - Display.print_task_list_formatted on the whole list
+      view          - all three of the above, end to end
+      view_page     - the same for the first page of `--page 1`
+      view_stream   - Display.print_task_list streaming the whole list in
+                      chunks, as `python-todo -v` does
+      export        - TodoStore.export_tasks writing the whole list as JSONL
+      add_task      - DB.add_task, per task
+      remove_task   - DB.remove_task, per task
+
+    Whole list operations on a million tasks take minutes; use --ops to
+    pick operations.
+
+    Usage: python benchmarks/bench.py [--sizes 10000,100000,1000000]
+                                      [--ops view,add_task] [--repeat N]
+                                      [--output results.json] [--compare old.json]
+
+    Results are written as JSON so runs can be compared across commits.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+import contextlib
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from todo_app import db, dates, display, store
+
+DEFAULT_SIZES = (10000, 100000, 1000000)
+
+# Single task operations are averaged over this many tasks
+SINGLE_TASK_OPS = 200
+
+# Tasks shown by the view_page operation
+PAGE_SIZE = 50
+
+# Tasks read at a time by the view_stream operation
+STREAM_CHUNK_SIZE = 500
+
+WORDS = ('deploy', 'review', 'fix', 'update', 'write', 'docs', 'release', 'call', 'email', 'plan',
+         'meeting', 'budget', 'report', 'server', 'backup', 'tests', 'refactor', 'invoice', 'design',
+         'draft', 'groceries', 'dentist', 'taxes', 'garden', 'car', 'laundry', 'bug', 'feature',
+         'migration', 'database', 'client', 'quarterly', 'roadmap', 'hiring', 'onboarding', 'security')
+
+def random_text(rng, min_words, max_words):
+    """ Returns a sentence of random words """
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words)))
+
+def seed_tasks(rng, size):
+    """ Yields (date, title, description, due, finished) rows for the seed.
+        Tasks were added over the past two years, 40% have no due date and
+        the rest are due between two months ago and six months from now,
+        30% are finished and 30% have no description """
+    now = int(time.time())
+    today = dates.today()
+    for _ in range(size):
+        added = now - rng.randint(0, 2 * 365 * 86400)
+        title = random_text(rng, 1, 8).capitalize()
+        description = '' if rng.random() < 0.3 else random_text(rng, 3, 40)
+        due = None if rng.random() < 0.4 else today + rng.randint(-60, 180)
+        finished = 1 if rng.random() < 0.3 else 0
+        yield added, title, description, due, finished
+
+def seed_database(path, size):
+    """ Creates a task list with `size` tasks at path """
+    database = db.DB(path)
+    cursor = database.db_connection.cursor()
+    cursor.executemany('INSERT INTO task_list (date, title, description, due, finished) VALUES (?, ?, ?, ?, ?)',
+                       seed_tasks(random.Random(size), size))
+    database.db_connection.commit()
+    return database
+
+def timed(function, repeat):
+    """ Runs function `repeat` times. Returns the median seconds per run
+        and the per stage timings recorded by the last run """
+    timings = []
+    stages = {}
+    for _ in range(repeat):
+        stages = {}
+        start = time.perf_counter()
+        function(stages)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), stages
+
+def peak_memory(function):
+    """ Returns the peak bytes allocated while running function """
+    tracemalloc.start()
+    try:
+        function({})
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def stage(stages, name, function, *args):
+    """ Runs one stage of an operation, recording how long it took """
+    start = time.perf_counter()
+    result = function(*args)
+    stages[name] = time.perf_counter() - start
+    return result
+
+def make_operations(database, todo_display):
+    """ Returns the benchmarked operations, each taking a dict to record
+        its stage timings in """
+    # Output is thrown away, so it doesn't count towards peak memory
+    sink = open(os.devnull, 'w', encoding='utf-8')
+
+    def print_table(rows):
+        with contextlib.redirect_stdout(sink):
+            todo_display.print_task_list_formatted(rows)
+
+    def get_tasks(stages):
+        stage(stages, 'get_tasks', database.get_tasks)
+
+    def format_row(stages):
+        rows = database.get_tasks()
+        stage(stages, 'format_row', todo_display.format_row, rows)
+
+    def print_table_op(stages):
+        rows = todo_display.format_row(database.get_tasks())
+        stage(stages, 'print_table', print_table, rows)
+
+    def view(stages):
+        rows = stage(stages, 'get_tasks', database.get_tasks)
+        rows = stage(stages, 'format_row', todo_display.format_row, rows)
+        stage(stages, 'print_table', print_table, rows)
+
+    def view_page(stages):
+        rows = stage(stages, 'get_tasks', lambda: next(database.iter_task_pages(PAGE_SIZE)))
+        rows = stage(stages, 'format_row', todo_display.format_row, rows)
+        stage(stages, 'print_table', print_table, rows)
+
+    def view_stream(stages):
+        def print_task_list():
+            with contextlib.redirect_stdout(sink):
+                todo_display.print_task_list(database.iter_task_pages(STREAM_CHUNK_SIZE), database.get_num_tasks())
+        stage(stages, 'print_task_list', print_task_list)
+
+    def export(stages):
+        stage(stages, 'export', store.TodoStore(backend=database).export_tasks, sink)
+
+    def stats(stages):
+        stage(stages, 'get_stats', database.get_stats)
+
+    def add_task(stages):
+        for _ in range(SINGLE_TASK_OPS):
+            database.add_task('Benchmark task', 'Added by the benchmark', '')
+
+    def remove_task(stages):
+        cursor = database.db_connection.cursor()
+        cursor.execute('SELECT id FROM task_list ORDER BY random() LIMIT ?', (SINGLE_TASK_OPS,))
+        for (task_id,) in cursor.fetchall():
+            database.remove_task(task_id)
+
+    return {
+        'get_tasks': (get_tasks, 1),
+        'format_row': (format_row, 1),
+        'print_table': (print_table_op, 1),
+        'view': (view, 1),
+        'view_page': (view_page, 1),
+        'view_stream': (view_stream, 1),
+        'export': (export, 1),
+        'stats': (stats, 1),
+        'add_task': (add_task, SINGLE_TASK_OPS),
+        'remove_task': (remove_task, SINGLE_TASK_OPS)
+    }
+
+def run_size(size, op_names, repeat, temp_dir):
+    """ Benchmarks every operation against a task list of the given size """
+    print(f'Seeding {size:,} tasks...', file=sys.stderr)
+    start = time.perf_counter()
+    database = seed_database(os.path.join(temp_dir, f'todo-{size}.db'), size)
+    seed_seconds = time.perf_counter() - start
+
+    operations = make_operations(database, display.Display())
+    results = {}
+    for name in op_names:
+        function, per = operations[name]
+        print(f'  {name}', file=sys.stderr)
+        seconds, stages = timed(function, repeat)
+        results[name] = {
+            'seconds': seconds / per,
+            'stages': {stage_name: stage_seconds / per for stage_name, stage_seconds in stages.items()},
+            'peak_memory_bytes': peak_memory(function)
+        }
+
+    database.db_connection.close()
+    return {'seed_seconds': seed_seconds, 'operations': results}
+
+def git_commit():
+    """ Returns the commit being benchmarked, if this is a git checkout """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_summary(results, previous):
+    """ Prints a table of results, with the change from a previous run """
+    for size, size_results in results['sizes'].items():
+        print(f'\n{int(size):,} tasks (seeded in {size_results["seed_seconds"]:.1f}s)')
+        for name, result in size_results['operations'].items():
+            line = f'  {name:<12} {result["seconds"] * 1000:10.2f} ms  {result["peak_memory_bytes"] / 2**20:8.1f} MiB'
+            try:
+                old = previous['sizes'][size]['operations'][name]['seconds']
+                line += f'  {result["seconds"] / old:6.2f}x'
+            except (KeyError, TypeError, ZeroDivisionError):
+                pass
+            print(line)
+            for stage_name, seconds in result['stages'].items():
+                print(f'    {stage_name:<10} {seconds * 1000:10.2f} ms')
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks python-todo on large task lists')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help='Comma separated task list sizes')
+    parser.add_argument('--ops', help='Comma separated operations to run (default all)')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per operation (default 3)')
+    parser.add_argument('--output', help='Writes the results as JSON to this file')
+    parser.add_argument('--compare', help='Shows the change from results previously written with --output')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    op_names = args.ops.split(',') if args.ops else list(make_operations(None, None))
+
+    # Wide enough for the table check to always pass
+    os.environ['COLUMNS'] = '1000'
+
+    results = {
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'sqlite': db.sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'sizes': {}
+    }
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for size in sizes:
+            results['sizes'][str(size)] = run_size(size, op_names, args.repeat, temp_dir)
+
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as previous_file:
+            previous = json.load(previous_file)
+    print_summary(results, previous)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(results, output_file, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+""" Checks that python-todo starts quickly enough to be called from a shell
+    prompt or status bar.
+
+    Runs `python-todo -v` against a temporary task list several times and
+    measures, on top of what a bare `python -c pass` costs on this machine:
+
+      import  - how long importing todo_app.todo takes
+      ttfb    - time from starting the process to the first byte of output
+      total   - time until the process exits
+
+    The median of each is compared with STARTUP_BUDGET_MS. Exits with a
+    non-zero status if any of them is over budget.
+
+    Usage: python benchmarks/startup.py [--runs N] [--json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+# Allowed milliseconds on top of a bare interpreter start, per measurement
+STARTUP_BUDGET_MS = {
+    'import': 40,
+    'ttfb': 60,
+    'total': 90
+}
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RUN_TODO = 'import sys; from todo_app.todo import run; sys.argv = ["python-todo", "-v"]; run()'
+IMPORT_TODO = 'import time; start = time.perf_counter(); import todo_app.todo; print(time.perf_counter() - start)'
+
+def run_once(code, env):
+    """ Runs `python -c code`, returning (seconds to first byte, seconds to exit, output) """
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, env=env, cwd=REPO_ROOT)
+    first = process.stdout.read(1)
+    first_byte = time.perf_counter() - start
+    rest = process.stdout.read()
+    process.wait()
+    return first_byte, time.perf_counter() - start, first + rest
+
+def measure(runs, env):
+    """ Returns the median of each measurement, in milliseconds """
+    _, bare_total, _ = min(run_once('pass', env) for _ in range(runs))
+
+    imports = []
+    ttfbs = []
+    totals = []
+    for _ in range(runs):
+        imports.append(float(run_once(IMPORT_TODO, env)[2]))
+        first_byte, total, _ = run_once(RUN_TODO, env)
+        ttfbs.append(first_byte - bare_total)
+        totals.append(total - bare_total)
+
+    return {
+        'import': statistics.median(imports) * 1000,
+        'ttfb': statistics.median(ttfbs) * 1000,
+        'total': statistics.median(totals) * 1000
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Checks python-todo startup time against a budget')
+    parser.add_argument('--runs', type=int, default=15, help='Runs per measurement (default 15)')
+    parser.add_argument('--json', action='store_true', help='Prints results as JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        env = dict(os.environ, TODO_DB=os.path.join(temp_dir, 'todo.db'), PYTHONPATH=REPO_ROOT)
+        # Create the database (and a task) up front so runs measure the steady state
+        subprocess.run([sys.executable, '-c', 'from todo_app.db import DB; DB().add_task("Benchmark", "", "")'],
+                       env=env, cwd=REPO_ROOT, check=True)
+        results = measure(args.runs, env)
+
+    over_budget = [name for name, ms in results.items() if ms > STARTUP_BUDGET_MS[name]]
+
+    if args.json:
+        print(json.dumps({'results_ms': results, 'budget_ms': STARTUP_BUDGET_MS, 'over_budget': over_budget}, indent=2))
+    else:
+        for name, ms in results.items():
+            status = 'OVER BUDGET' if name in over_budget else 'ok'
+            print(f'{name:<7} {ms:7.1f} ms  (budget {STARTUP_BUDGET_MS[name]} ms)  {status}')
+
+    sys.exit(1 if over_budget else 0)
+
+if __name__ == '__main__':
+    main()
@@ -8,7 +8,7 @@ with open(path.join(this_directory, 'README.md'), encoding='utf-8') as f:
 setup(
     name='python-todo',
     version='0.4.1',
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     description='A command line todo application',
     long_description = long_description,
     long_description_content_type='text/markdown',
@@ -22,7 +22,8 @@ setup(
     ],
     entry_points={
           "console_scripts": [
-              'python-todo = todo_app.todo:run'
+              'python-todo = todo_app.todo:run',
+              'python-todo-client = todo_app.client:main'
           ]
     },
     zip_safe=False)
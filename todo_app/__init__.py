@@ -0,0 +1,9 @@
+from .models import Task
+
+def __getattr__(name):
+    # The store pulls in the database layer, which commands going through
+    # the client (see client.py) never need, so it's only imported when used
+    if name in ('TodoStore', 'AsyncTodoStore'):
+        from . import store
+        return getattr(store, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
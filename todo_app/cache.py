@@ -0,0 +1,88 @@
+""" A cache of the last rendered task table, kept in a file next to the
+    database (~/.todo.db.view-cache).
+
+    The first line of the file is the JSON header {"key": ..., "valid_until": ...}
+    and the rest is the output exactly as it was printed. `key` holds
+    everything the output depends on: the task list's revision (see
+    DB.commit), the terminal width and the view options. `valid_until` is
+    when the output would first look different anyway, because an 'Added'
+    age moves on to its next value or a due date changes color at midnight.
+"""
+import os
+import json
+import time
+
+CACHE_SUFFIX = '.view-cache'
+
+# Views bigger than this are shown as usual, but not cached
+MAX_CACHED_CHARS = 1024 * 1024
+
+def cache_path(db_file):
+    """ Returns the path of the view cache belonging to db_file """
+    return db_file + CACHE_SUFFIX
+
+def make_key(revision, width, options):
+    """ Returns the cache key for a view of the task list """
+    return json.dumps([revision, width, options], sort_keys=True)
+
+def load(path, key):
+    """ Returns the cached output if it was stored under key and is still
+        accurate, or None """
+    try:
+        with open(path, encoding='utf-8') as cache_file:
+            header = json.loads(cache_file.readline())
+            if header['key'] != key or time.time() >= header['valid_until']:
+                return None
+            return cache_file.read()
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def save(path, key, output, valid_until):
+    """ Stores output under key until valid_until (seconds since the epoch).
+        The file is replaced in one go, so readers never see half of it """
+    temp_path = f'{path}.{os.getpid()}'
+    try:
+        # Only readable by the user, like the database itself should be
+        descriptor = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(descriptor, 'w', encoding='utf-8') as cache_file:
+            cache_file.write(json.dumps({'key': key, 'valid_until': valid_until}) + '\n')
+            cache_file.write(output)
+        os.replace(temp_path, path)
+    except OSError:
+        # The cache is only an optimization
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+
+def invalidate(path):
+    """ Throws away the cached view """
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+class Recorder:
+    """ Passes everything written to it on to a stream, keeping a copy for
+        the cache until the copy grows past MAX_CACHED_CHARS """
+    def __init__(self, stream):
+        self.stream = stream
+        self.parts = []
+        self.size = 0
+        self.complete = True
+
+    def write(self, text):
+        if self.complete:
+            self.size += len(text)
+            if self.size > MAX_CACHED_CHARS:
+                self.complete = False
+                self.parts = []
+            else:
+                self.parts.append(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def getvalue(self):
+        return ''.join(self.parts)
@@ -0,0 +1,159 @@
+""" A thin client for the python-todo daemon (see server.py).
+
+    Requests and responses are single lines of JSON sent over a Unix socket
+    next to the database (~/.todo.db.sock unless $TODO_SOCKET is set), one
+    request per connection:
+
+        {"command": "finish_task", "args": [12], "kwargs": {}}
+        {"ok": true, "result": null}
+
+    `command` is one of REMOTE_METHODS (called on the daemon's db.DB, with
+    any Task in the result sent as a list of its fields), or
+    "view" to get the task table already rendered for a terminal width:
+
+        {"command": "view", "args": [], "kwargs": {"width": 120, "status": "open"}}
+        {"ok": true, "result": "+----+------------+ ..."}
+
+    This module only imports what it needs to talk to the daemon, so it can
+    be called from status bars and editors as `python-todo-client`. When no
+    daemon is running it falls back to using the database directly.
+"""
+import os
+import sys
+import json
+import socket
+
+# Environment variable that overrides where the daemon's socket is
+SOCKET_ENV = 'TODO_SOCKET'
+
+# Methods of db.DB that clients may call on the daemon
+REMOTE_METHODS = ('get_num_tasks', 'get_stats', 'has_tasks', 'get_task', 'resolve_id', 'resolve_ids', 'add_task', 'add_tasks',
+                  'remove_task', 'remove_tasks', 'finish_task', 'finish_tasks', 'unfinish_task',
+                  'unfinish_tasks', 'update_task', 'update_tasks', 'archive_tasks', 'archive_if_due',
+                  'restore_tasks', 'compact')
+
+# Methods that change the task list
+WRITE_METHODS = ('add_task', 'add_tasks', 'remove_task', 'remove_tasks', 'finish_task', 'finish_tasks',
+                 'unfinish_task', 'unfinish_tasks', 'update_task', 'update_tasks', 'archive_tasks', 'archive_if_due',
+                 'restore_tasks')
+
+class DaemonError(Exception):
+    """ Raised when the daemon can't carry out a request """
+
+def socket_path(db_file):
+    """ Returns the path of the socket a daemon serving db_file listens on """
+    return os.environ.get(SOCKET_ENV) or db_file + '.sock'
+
+class RemoteDB:
+    """ Stands in for db.DB when a daemon is serving the task list. Each of
+        REMOTE_METHODS is forwarded to the daemon """
+    def __init__(self, path):
+        self.path = path
+
+    def call(self, command, *args, **kwargs):
+        """ Sends one request to the daemon and returns its result """
+        request = json.dumps({'command': command, 'args': args, 'kwargs': kwargs}).encode('utf-8') + b'\n'
+
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(self.path)
+                sock.sendall(request)
+                with sock.makefile('rb') as reader:
+                    line = reader.readline()
+        except OSError as err:
+            # Not retried on the database directly: the daemon may have made
+            # the change before it went away
+            raise DaemonError(f'Lost the connection to the daemon ({err.strerror or err}). '
+                              'Check the task list before trying again') from err
+
+        if not line:
+            raise DaemonError('The daemon closed the connection')
+        try:
+            response = json.loads(line)
+        except ValueError as err:
+            raise DaemonError('The daemon sent a reply that couldn\'t be read') from err
+        if not response['ok']:
+            raise DaemonError(response['error'])
+        return response['result']
+
+    def __getattr__(self, name):
+        if name not in REMOTE_METHODS:
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self.call(name, *args, **kwargs)
+
+    def get_task(self, task_id):
+        """ Like DB.get_task. Tasks are sent as a list of their fields """
+        from .models import Task
+        fields = self.call('get_task', task_id)
+        return Task(*fields) if fields is not None else None
+
+    def print_tasks(self, display, **options):
+        """ Prints the task table, rendered by the daemon, like views.print_tasks """
+        sys.stdout.write(self.call('view', width=display.terminal_width(), **options))
+        sys.stdout.flush()
+
+def served_file(path):
+    """ Returns the database file served by the daemon listening on the
+        socket at `path`, or None if no daemon is listening there """
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(path):
+        return None
+    try:
+        return RemoteDB(path).call('ping')
+    except (OSError, ValueError, DaemonError):
+        return None # Left behind by a daemon that didn't shut down cleanly
+
+def connect(db_file):
+    """ Returns a RemoteDB if a daemon is serving db_file, or None. A
+        daemon serving another task list (through $TODO_SOCKET) isn't used """
+    path = socket_path(db_file)
+    served = served_file(path)
+    if served is None or os.path.realpath(served) != os.path.realpath(db_file):
+        return None
+    return RemoteDB(path)
+
+def main(argv=None):
+    """ Entry point for python-todo-client:
+
+            python-todo-client view [WIDTH]
+            python-todo-client stats
+            python-todo-client add TITLE [DESCRIPTION [DUE]]
+            python-todo-client remove|finish|unfinish ID
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    commands = ('view', 'stats', 'add', 'remove', 'finish', 'unfinish')
+    if not argv or argv[0] not in commands or (argv[0] in commands[3:] and len(argv) != 2) or (argv[0] == 'add' and len(argv) < 2):
+        sys.stderr.write(main.__doc__.split(':', 1)[1].replace('            ', '') + '\n')
+        sys.exit(2)
+
+    from . import db
+    db_file = db.resolve_db_file()
+    backend = connect(db_file) or db.DB(db_file)
+    command = argv[0]
+
+    try:
+        if command == 'view':
+            from . import views
+            from .display import Display
+            display = Display(term_width=int(argv[1]) if len(argv) > 1 else None)
+            if isinstance(backend, RemoteDB):
+                backend.print_tasks(display)
+            else:
+                views.print_cached_tasks(backend, display)
+        elif command == 'stats':
+            from .display import Display
+            print(Display.format_stats(backend.get_stats()))
+        elif command == 'add':
+            title, description, due = (argv[1:] + ['', ''])[:3]
+            backend.add_task(title, description, due)
+        else:
+            task_id = backend.resolve_id(argv[1])
+            if task_id is None:
+                sys.stderr.write(f'Invalid ID given: {argv[1]}\n')
+                sys.exit(1)
+            getattr(backend, f'{command}_task')(task_id)
+    except (DaemonError, ValueError) as err:
+        sys.stderr.write(f'{err}\n')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+import time
+from datetime import date, datetime, timedelta
+
+# Due dates are stored as Julian day numbers, which SQLite's own date
+# functions understand. Python's date ordinals are a fixed offset away
+JULIAN_DAY_OFFSET = 1721425
+
+# Formats accepted when the user types a date
+DATE_FORMATS = ('%m/%d/%Y', '%m-%d-%Y')
+
+# Format due dates are shown in
+DISPLAY_FORMAT = '%m/%d/%Y'
+
+# How often a task can repeat: every 1-MAX_REPEAT_COUNT days, weeks or
+# months. Repeating every single unit has a name of its own
+REPEAT_UNITS = ('day', 'week', 'month')
+REPEAT_NAMES = {'daily': 'day', 'weekly': 'week', 'monthly': 'month'}
+MAX_REPEAT_COUNT = 99
+
+# Format of the day a stored repeat rule counts from, as in
+# 'monthly from 2027-01-31'
+REPEAT_ANCHOR_FORMAT = '%Y-%m-%d'
+
+def parse_date(date_str):
+    """ Parses a date typed by the user. Raises ValueError if it isn't in
+        one of the accepted formats """
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(date_str, date_format).date()
+        except ValueError:
+            pass
+    raise ValueError(f'{date_str!r} is not a valid date')
+
+def to_day(value):
+    """ Converts a due date into the day number stored in the database.
+        Accepts a date typed by the user, a date object or a day number.
+        An empty due date is stored as NULL """
+    if value is None or value == '':
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, date):
+        return value.toordinal() + JULIAN_DAY_OFFSET
+    return parse_date(value).toordinal() + JULIAN_DAY_OFFSET
+
+def from_day(day):
+    """ Converts a stored day number back into a date object """
+    return date.fromordinal(day - JULIAN_DAY_OFFSET)
+
+def format_day(day):
+    """ Formats a stored day number the way due dates are shown """
+    if day is None:
+        return ''
+    return from_day(day).strftime(DISPLAY_FORMAT)
+
+def parse_repeat(rule):
+    """ Parses how often a task repeats, such as 'weekly' or 'every 2
+        weeks', optionally followed by the day it counts from, such as
+        'monthly from 2027-01-31'. Returns a (count, unit, day number)
+        triple, the day being None when the rule doesn't give one. Raises
+        ValueError if it isn't understood """
+    every, _, anchor = rule.strip().lower().partition(' from ')
+    if anchor:
+        try:
+            anchor = to_day(datetime.strptime(anchor.strip(), REPEAT_ANCHOR_FORMAT).date())
+        except ValueError:
+            raise ValueError(f'{anchor.strip()!r} is not a day to repeat from (such as 2027-01-31)') from None
+    else:
+        anchor = None
+
+    words = every.split()
+    if len(words) == 1 and words[0] in REPEAT_NAMES:
+        return 1, REPEAT_NAMES[words[0]], anchor
+    if len(words) == 2:
+        words.insert(1, '1')
+    if len(words) == 3 and words[0] == 'every' and words[1].isdigit():
+        count = int(words[1])
+        unit = words[2][:-1] if words[2].endswith('s') else words[2]
+        if unit in REPEAT_UNITS and 1 <= count <= MAX_REPEAT_COUNT:
+            return count, unit, anchor
+    raise ValueError(f'{rule!r} is not a way to repeat (daily, weekly, monthly or every N days/weeks/months, '
+                     f'N up to {MAX_REPEAT_COUNT})')
+
+def to_repeat(value, due=None):
+    """ Converts how often a task repeats into the rule stored in the
+        database: 'daily', 'weekly', 'monthly' or 'every N units', then
+        the day its occurrences are counted from, as in 'monthly from
+        2027-01-31'. A rule that doesn't give that day counts from `due` (a
+        day number), when there is one. A task that doesn't repeat is
+        stored as NULL """
+    if value is None or value.strip() == '':
+        return None
+    count, unit, anchor = parse_repeat(value)
+    if count == 1:
+        rule = next(name for name, named_unit in REPEAT_NAMES.items() if named_unit == unit)
+    else:
+        rule = f'every {count} {unit}s'
+    if anchor is None:
+        anchor = due
+    if anchor is not None:
+        rule += f' from {from_day(anchor).strftime(REPEAT_ANCHOR_FORMAT)}'
+    return rule
+
+def without_anchor(rule):
+    """ Returns a repeat rule without the day it counts from, so it counts
+        from the task's due date again """
+    return to_repeat(rule.partition(' from ')[0])
+
+def occurrences(due, rule, start=None):
+    """ Yields the days (as day numbers) a task repeating by `rule` falls
+        on, oldest first and without end, starting from the day the rule
+        counts from (see to_repeat), or from the task's due date `due` for
+        rules that don't give one. With a `start` day, occurrences before it
+        are skipped without being worked out one by one. A task repeating
+        monthly on the 31st falls on the last day of shorter months, and
+        back on the 31st after them """
+    count, unit, anchor = parse_repeat(rule)
+    if anchor is None:
+        anchor = due
+
+    if unit != 'month':
+        step = count * 7 if unit == 'week' else count
+        day = anchor
+        if start is not None and start > anchor:
+            day += -(-(start - anchor) // step) * step
+        while True:
+            yield day
+            day += step
+
+    first = from_day(anchor)
+    month = first.year * 12 + first.month - 1
+    if start is not None and start > anchor:
+        # Lands at most one step short of `start`
+        start_date = from_day(start)
+        month += max((start_date.year * 12 + start_date.month - 1 - month) // count - 1, 0) * count
+    while True:
+        year, month_index = divmod(month, 12)
+        next_year, next_month_index = divmod(month + 1, 12)
+        month_length = (date(next_year, next_month_index + 1, 1) - timedelta(days=1)).day
+        day = to_day(date(year, month_index + 1, min(first.day, month_length)))
+        if start is None or day >= start:
+            yield day
+        month += count
+
+def next_occurrence(due, rule, after):
+    """ Returns the first day after `after` that a repeating task falls on """
+    return next(occurrences(due, rule, after + 1))
+
+def today():
+    """ Returns today's (local) day number """
+    return to_day(date.today())
+
+def next_midnight():
+    """ Returns when tomorrow starts (local time), in seconds since the epoch """
+    return time.mktime((date.today() + timedelta(days=1)).timetuple())
+
+def to_timestamp(value):
+    """ Converts a 'yyyy-mm-dd hh:mm:ss' local time, as stored by older
+        versions of the database, into seconds since the epoch """
+    if value is None:
+        return None
+    return int(time.mktime(time.strptime(value, '%Y-%m-%d %H:%M:%S')))
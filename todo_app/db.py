@@ -1,101 +1,1192 @@
+import os
+import json
+import time
 import sqlite3
-from pathlib import Path
+import contextlib
+from . import dates
+from . import cache
+from .models import Task
+
+# Bumped whenever the layout of the database changes. Stored in the
+# database itself through `PRAGMA user_version`
+#   1: tasks get a stable INTEGER PRIMARY KEY
+#   2: indexes and full text search for filtering
+#   3: added/due stored as epoch seconds and Julian day numbers
+#   4: a meta table holding the task list's revision
+#   5: when tasks were finished, and an archive of old finished tasks
+#   6: task counts kept up to date by triggers
+#   7: the revision each task was last changed in
+#   8: tasks get a uid shared between copies of the task list, and every
+#      change is logged for --sync-export
+#   9: tasks can repeat
+#  10: IDs of removed or archived tasks are never handed out again
+SCHEMA_VERSION = 10
+
+# Columns selected for each task, in the order Task expects them
+TASK_COLUMNS = 'id, date, title, description, due, finished, repeat'
+
+# The valid values for the --status filter
+STATUSES = {
+    'open': 0,
+    'finished': 1
+}
+
+# Rows copied per batch while rebuilding the task list
+MIGRATION_BATCH_SIZE = 10000
+
+# Finished tasks moved to the archive per transaction
+ARCHIVE_BATCH_SIZE = 5000
+
+# Finished tasks are archived this many days after they were finished,
+# unless $TODO_ARCHIVE_DAYS says otherwise ('never' turns it off)
+DEFAULT_ARCHIVE_DAYS = 30
+ARCHIVE_DAYS_ENV = 'TODO_ARCHIVE_DAYS'
+
+# Old finished tasks are looked for at most this often (in seconds)
+ARCHIVE_INTERVAL = 86400
+
+# Keeps the full text index up to date as tasks are added
+FTS_INSERT_TRIGGER = '''CREATE TRIGGER IF NOT EXISTS task_fts_insert AFTER INSERT ON task_list BEGIN
+                          INSERT INTO task_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+                        END'''
+
+# Keep task_stats (total, finished and archived tasks) and due_stats (open
+# tasks due each day) up to date, so counting never has to scan the task list
+STATS_INSERT_TRIGGER = '''CREATE TRIGGER IF NOT EXISTS task_stats_insert AFTER INSERT ON task_list BEGIN
+                            UPDATE task_stats SET value = value + CASE name WHEN 'total' THEN 1 ELSE new.finished END
+                            WHERE name IN ('total', 'finished');
+                            INSERT INTO due_stats (day, open) SELECT new.due, 1 WHERE new.finished = 0 AND new.due IS NOT NULL
+                            ON CONFLICT (day) DO UPDATE SET open = open + 1;
+                          END'''
+STATS_TRIGGERS = (
+    STATS_INSERT_TRIGGER,
+    '''CREATE TRIGGER IF NOT EXISTS task_stats_delete AFTER DELETE ON task_list BEGIN
+         UPDATE task_stats SET value = value - CASE name WHEN 'total' THEN 1 ELSE old.finished END
+         WHERE name IN ('total', 'finished');
+         UPDATE due_stats SET open = open - 1 WHERE day = old.due AND old.finished = 0;
+         DELETE FROM due_stats WHERE day = old.due AND open = 0;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS task_stats_update AFTER UPDATE OF finished, due ON task_list
+       WHEN new.finished != old.finished OR new.due IS NOT old.due BEGIN
+         UPDATE task_stats SET value = value + new.finished - old.finished WHERE name = 'finished';
+         UPDATE due_stats SET open = open - 1 WHERE day = old.due AND old.finished = 0;
+         DELETE FROM due_stats WHERE day = old.due AND open = 0;
+         INSERT INTO due_stats (day, open) SELECT new.due, 1 WHERE new.finished = 0 AND new.due IS NOT NULL
+         ON CONFLICT (day) DO UPDATE SET open = open + 1;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS archive_stats_insert AFTER INSERT ON archive BEGIN
+         UPDATE task_stats SET value = value + 1 WHERE name = 'archived';
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS archive_stats_delete AFTER DELETE ON archive BEGIN
+         UPDATE task_stats SET value = value - 1 WHERE name = 'archived';
+       END'''
+)
+
+# Keep each task's `rev` at the revision (see DB.commit) it was last added or
+# changed in. The commit bumps the revision in the same transaction, so the
+# trigger can tell what it will be. Inserts that give a rev themselves skip it
+REV_TRIGGERS = (
+    '''CREATE TRIGGER IF NOT EXISTS task_rev_insert AFTER INSERT ON task_list WHEN new.rev = 0 BEGIN
+         UPDATE task_list SET rev = (SELECT value + 1 FROM meta WHERE key = 'revision') WHERE id = new.id;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS task_rev_update AFTER UPDATE OF date, title, description, due, finished, repeat ON task_list BEGIN
+         UPDATE task_list SET rev = (SELECT value + 1 FROM meta WHERE key = 'revision') WHERE id = new.id;
+       END'''
+)
+
+# The rev a task added by the current transaction gets, for inserts of many
+# tasks (where the insert trigger would double the work)
+NEXT_REV = "(SELECT value + 1 FROM meta WHERE key = 'revision')"
+
+# Fields of a task that are synced between task lists. `archived` (whether
+# the task is in the archive) is synced like a field too
+SYNCED_FIELDS = ('date', 'title', 'description', 'due', 'finished', 'repeat')
+
+# Fields a change has to give to add a task that isn't here yet. Changes
+# logged before tasks could repeat don't give `repeat`
+NEW_TASK_FIELDS = ('date', 'title', 'description', 'due', 'finished', 'archived')
+
+# When a change was made, in seconds since the epoch to the millisecond.
+# Decides which of two changes made on different machines wins
+CHANGE_TS = "((julianday('now') - 2440587.5) * 86400.0)"
+
+# The origin stamped on changes made here
+ORIGIN = "(SELECT value FROM meta WHERE key = 'origin')"
+
+# Changes applied by DB.apply_changes are logged as they were made
+# elsewhere, rather than by the triggers
+NOT_SYNCING = "NOT EXISTS (SELECT 1 FROM meta WHERE key = 'syncing')"
+
+# A new uid: the time in nanoseconds then 16 random hex digits, so new uids
+# are added to the end of the uid index rather than all over it
+NEW_UID = "printf('%016x', CAST(((julianday('now') - 2440587.5) * 86400000000000) AS INTEGER)) || lower(hex(randomblob(8)))"
+
+# Log every change to the task list in `changes`. Tasks added without a uid
+# are given one (see NEW_UID). Adding a task that's in the archive is restoring it, and
+# removing one that was just copied to the archive is archiving it
+CHANGE_INSERT_TRIGGER = f'''CREATE TRIGGER IF NOT EXISTS task_changes_insert AFTER INSERT ON task_list WHEN {NOT_SYNCING} BEGIN
+                              UPDATE task_list SET uid = {NEW_UID} WHERE id = new.id AND uid IS NULL;
+                              INSERT INTO changes (uid, op, payload, ts, origin)
+                              SELECT uid, CASE WHEN EXISTS (SELECT 1 FROM archive WHERE archive.uid = task_list.uid) THEN 'restore' ELSE 'add' END,
+                                     json_object('date', date, 'title', title, 'description', description, 'due', due,
+                                                 'finished', finished, 'repeat', repeat, 'archived', 0),
+                                     {CHANGE_TS}, {ORIGIN}
+                              FROM task_list WHERE id = new.id;
+                            END'''
+CHANGE_TRIGGERS = (
+    CHANGE_INSERT_TRIGGER,
+    # Only the fields that changed are logged, so changes to different
+    # fields of a task on different machines both survive a sync
+    f'''CREATE TRIGGER IF NOT EXISTS task_changes_update AFTER UPDATE OF date, title, description, due, finished, repeat ON task_list
+        WHEN (new.date IS NOT old.date OR new.title IS NOT old.title OR new.description IS NOT old.description
+              OR new.due IS NOT old.due OR new.finished IS NOT old.finished OR new.repeat IS NOT old.repeat) AND {NOT_SYNCING} BEGIN
+          INSERT INTO changes (uid, op, payload, ts, origin)
+          VALUES (new.uid,
+                  CASE WHEN new.date IS old.date AND new.title IS old.title AND new.description IS old.description AND new.due IS old.due
+                            AND new.repeat IS old.repeat
+                       THEN CASE new.finished WHEN 1 THEN 'finish' ELSE 'unfinish' END
+                       ELSE 'update' END,
+                  (SELECT json_group_object(field, value) FROM
+                    (SELECT 'date' AS field, new.date AS value WHERE new.date IS NOT old.date UNION ALL
+                     SELECT 'title', new.title WHERE new.title IS NOT old.title UNION ALL
+                     SELECT 'description', new.description WHERE new.description IS NOT old.description UNION ALL
+                     SELECT 'due', new.due WHERE new.due IS NOT old.due UNION ALL
+                     SELECT 'finished', new.finished WHERE new.finished IS NOT old.finished UNION ALL
+                     SELECT 'repeat', new.repeat WHERE new.repeat IS NOT old.repeat)),
+                  {CHANGE_TS}, {ORIGIN});
+        END''',
+    f'''CREATE TRIGGER IF NOT EXISTS task_changes_delete AFTER DELETE ON task_list WHEN {NOT_SYNCING} BEGIN
+          INSERT INTO changes (uid, op, payload, ts, origin)
+          SELECT old.uid, 'archive',
+                 json_object('date', old.date, 'title', old.title, 'description', old.description, 'due', old.due,
+                             'finished', old.finished, 'repeat', old.repeat, 'archived', 1),
+                 {CHANGE_TS}, {ORIGIN}
+          WHERE EXISTS (SELECT 1 FROM archive WHERE uid = old.uid)
+          UNION ALL
+          SELECT old.uid, 'remove', NULL, {CHANGE_TS}, {ORIGIN}
+          WHERE NOT EXISTS (SELECT 1 FROM archive WHERE uid = old.uid);
+        END'''
+)
+
+# Environment variable that points python-todo at a different database
+DB_FILE_ENV = 'TODO_DB'
+
+# How connections to the database are set up. `busy_timeout` is how long
+# (in milliseconds) to wait for another process to finish writing before
+# giving up, `cached_statements` is how many prepared statements are kept
+# per connection, and `pragmas` are run on every new connection
+CONNECTION_PROFILES = {
+    # Write-ahead logging lets readers and a writer work at the same time.
+    # synchronous=NORMAL only syncs at checkpoints, which is still safe
+    # against corruption in WAL mode
+    'default': {
+        'busy_timeout': 5000,
+        'cached_statements': 256,
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'mmap_size': 64 * 1024 * 1024,
+            'cache_size': -8000, # Negative sizes are in KiB
+            'temp_store': 'MEMORY'
+        }
+    },
+    # Syncs every commit to disk, for databases on flaky storage
+    'durable': {
+        'busy_timeout': 5000,
+        'cached_statements': 256,
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'FULL',
+            'mmap_size': 64 * 1024 * 1024,
+            'cache_size': -8000,
+            'temp_store': 'MEMORY'
+        }
+    }
+}
+
+def resolve_db_file(db_file=None):
+    """ Returns the path of the task list database: the given file, else
+        $TODO_DB, else ~/.todo.db """
+    if db_file is None:
+        db_file = os.environ.get(DB_FILE_ENV) or '~/.todo.db'
+    return os.path.expanduser(db_file)
+
+def make_uids(count):
+    """ Returns `count` new uids for tasks added in bulk, in order. Like
+        NEW_UID they start with the time in nanoseconds, followed by random
+        hex digits shared by the batch and a count """
+    prefix = f'{time.time_ns():016x}{os.urandom(4).hex()}'
+    return [f'{prefix}{number:08x}' for number in range(count)]
+
+def archive_days():
+    """ Returns how many days after being finished tasks are archived:
+        $TODO_ARCHIVE_DAYS, else DEFAULT_ARCHIVE_DAYS. None if it's 'never' """
+    days = os.environ.get(ARCHIVE_DAYS_ENV, '').strip().lower()
+    if days == 'never':
+        return None
+    try:
+        return max(int(days), 0)
+    except ValueError:
+        return DEFAULT_ARCHIVE_DAYS
 
 class DB:
-    def __init__(self):
-        self.db_file = Path.home() / '.todo.db'
-        self.db_connection = sqlite3.connect(self.db_file)
+    """ The task list database.
+
+        Several processes (shells, cron jobs, status bars...) may use the same
+        database at once. Readers never block and are never blocked, since
+        the database runs in WAL mode. Every write starts with BEGIN IMMEDIATE,
+        so a writer waits its turn (for up to the profile's busy timeout)
+        rather than failing with 'database is locked' part way through """
+    # Class of the connection opened, swapped out by instrument.Profiler
+    connection_factory = sqlite3.Connection
+
+    def __init__(self, db_file=None, profile='default'):
+        self.db_file = resolve_db_file(db_file)
+        self.profile = CONNECTION_PROFILES[profile]
+        self.db_connection = self.connect()
         self.initialize_db()
 
+    def connect(self):
+        """ Opens a connection to the database set up from the profile """
+        connection = sqlite3.connect(self.db_file,
+                                     timeout=self.profile['busy_timeout'] / 1000,
+                                     cached_statements=self.profile['cached_statements'],
+                                     isolation_level='IMMEDIATE',
+                                     factory=self.connection_factory)
+
+        for pragma, value in self.profile['pragmas'].items():
+            try:
+                connection.execute(f'PRAGMA {pragma} = {value}')
+            except sqlite3.OperationalError:
+                # Switching to WAL needs a moment without other connections.
+                # The next connection will try again
+                pass
+
+        return connection
+
     def initialize_db(self):
-        """ Create the database if it doesn't already exist """
+        """ Create the database if it doesn't already exist, upgrading
+            the layout of older databases in place """
         cursor = self.db_connection.cursor()
+        cursor.execute('PRAGMA user_version')
+
+        if cursor.fetchone()[0] < SCHEMA_VERSION:
+            # Check again once we hold the write lock, another process may
+            # have set up the database in the meantime
+            with self.transaction():
+                cursor.execute('PRAGMA user_version')
+                version = cursor.fetchone()[0]
 
-        cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS task_list
-                        (date TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+                if version < 3:
+                    if self.table_exists('task_list'):
+                        self.migrate_task_list()
+                    else:
+                        self.create_task_list('task_list')
+                    self.create_indexes()
+                if version < 4:
+                    self.create_meta()
+                if version < 5:
+                    self.create_archive()
+                if version < 6:
+                    self.create_stats()
+                if version < 7:
+                    self.create_revs()
+                if version < 8:
+                    self.create_changes()
+                if version < 9:
+                    self.create_repeats()
+                if version < 10:
+                    for table in ('task_list', 'archive'):
+                        self.use_autoincrement(table)
+
+                cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+                self.db_connection.commit()
+
+        self.has_fts = self.table_exists('task_fts')
+
+    def table_exists(self, name):
+        """ Returns True if the database has a table with the given name """
+        cursor = self.db_connection.cursor()
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+        return cursor.fetchone()[0] > 0
+
+    def create_task_list(self, name):
+        """ Creates an empty task table. Tasks are keyed by an explicit
+            INTEGER PRIMARY KEY so their IDs survive deletes and VACUUM, and
+            AUTOINCREMENT so the ID of a removed task is never given to a
+            new one.
+            `date` is when the task was added in seconds since the epoch and
+            `due` is a Julian day number (or NULL), so both sort correctly """
+        cursor = self.db_connection.cursor()
+        cursor.execute(f'''
+                        CREATE TABLE {name}
+                        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        date INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
                         title text,
                         description text DEFAULT '',
-                        due DATE,
+                        due INTEGER,
                         finished BOOLEAN NOT NULL CHECK (finished in (0,1)) DEFAULT (0))
                        ''')
-        self.db_connection.commit()
 
-    def add_task(self, title, description, due, finished=0):
-        """ Adds a brand new task to the database """
+    def migrate_task_list(self):
+        """ Rebuilds a task list written by an older version. Text dates are
+            parsed once here instead of every time the list is shown, and
+            tasks created before they had a primary key keep their ROWID as
+            their stable ID """
+        read_cursor = self.db_connection.cursor()
+        write_cursor = self.db_connection.cursor()
+        self.create_task_list('task_list_new')
+
+        read_cursor.execute('SELECT ROWID, date, title, description, due, finished FROM task_list')
+        while True:
+            rows = read_cursor.fetchmany(MIGRATION_BATCH_SIZE)
+            if not rows:
+                break
+            write_cursor.executemany('''INSERT INTO task_list_new (id, date, title, description, due, finished)
+                                        VALUES (?, ?, ?, ?, ?, ?)''',
+                                     [(task_id, dates.to_timestamp(added), title, description, self.migrate_due(due), finished)
+                                      for task_id, added, title, description, due, finished in rows])
+
+        # Indexes and triggers go with the old table and are recreated afterwards
+        write_cursor.execute('DROP TABLE task_list')
+        write_cursor.execute('ALTER TABLE task_list_new RENAME TO task_list')
+
+    @staticmethod
+    def migrate_due(due):
+        """ Converts a text due date from an older version. Dates that can't
+            be read are dropped rather than failing the whole upgrade """
+        try:
+            return dates.to_day(due)
+        except ValueError:
+            return None
+
+    def create_indexes(self):
+        """ Adds the indexes used to filter the task list, and a full text
+            index over titles and descriptions that triggers keep in sync.
+            The full text index is skipped if SQLite was built without FTS5 """
         cursor = self.db_connection.cursor()
-        cursor.execute('INSERT INTO task_list (title, description, due, finished) VALUES (?, ?, ?, ?)', (title, description, due, finished))
-        self.db_connection.commit()
 
-    def remove_task(self, row_id):
-        """ Removes a task from the task list given its ID """
+        cursor.execute('CREATE INDEX IF NOT EXISTS task_list_finished ON task_list (finished)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS task_list_due ON task_list (due) WHERE due IS NOT NULL')
+
+        if not self.table_exists('task_fts'):
+            try:
+                cursor.execute('''CREATE VIRTUAL TABLE task_fts USING fts5
+                                  (title, description, content='task_list', content_rowid='id')''')
+            except sqlite3.OperationalError:
+                return # No FTS5, searches fall back to a scan
+            cursor.execute("INSERT INTO task_fts (task_fts) VALUES ('rebuild')")
+
+        cursor.execute(FTS_INSERT_TRIGGER)
+        cursor.execute('''CREATE TRIGGER IF NOT EXISTS task_fts_delete AFTER DELETE ON task_list BEGIN
+                            INSERT INTO task_fts (task_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+                          END''')
+        cursor.execute('''CREATE TRIGGER IF NOT EXISTS task_fts_update AFTER UPDATE OF title, description ON task_list BEGIN
+                            INSERT INTO task_fts (task_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+                            INSERT INTO task_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+                          END''')
+
+    def create_meta(self):
+        """ Creates the table of values kept about the task list as a whole """
         cursor = self.db_connection.cursor()
-        cursor.execute('DELETE FROM task_list WHERE ROWID = (?)', (row_id,))
-        self.db_connection.commit()
-        cursor.execute('VACUUM') # Clean up ID's
+        cursor.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)')
+        cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('revision', 0)")
 
-    def finish_task(self, row_id):
-        """ Changes a task from being unfinished to finished """
+    def create_archive(self):
+        """ Adds `finished_at` (seconds since the epoch, kept up to date by a
+            trigger) to the task list, and the archive table that old
+            finished tasks are moved to. Archived tasks get an ID of their
+            own, `task_id` is the ID they had in the task list """
+        cursor = self.db_connection.cursor()
+        cursor.execute('ALTER TABLE task_list ADD COLUMN finished_at INTEGER')
+        cursor.execute('''CREATE TRIGGER IF NOT EXISTS task_finished_at AFTER UPDATE OF finished ON task_list
+                          WHEN new.finished != old.finished BEGIN
+                            UPDATE task_list SET finished_at = CASE WHEN new.finished = 1 THEN CAST(strftime('%s', 'now') AS INTEGER) END
+                            WHERE id = new.id;
+                          END''')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS archive
+                          (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                          task_id INTEGER NOT NULL,
+                          date INTEGER NOT NULL,
+                          title text,
+                          description text DEFAULT '',
+                          due INTEGER,
+                          finished BOOLEAN NOT NULL DEFAULT (1),
+                          finished_at INTEGER,
+                          archived_at INTEGER NOT NULL)''')
+
+    def create_stats(self):
+        """ Creates the tables of task counts, counts the tasks already in
+            the database once, and adds the triggers that keep them counted """
+        cursor = self.db_connection.cursor()
+        cursor.execute('CREATE TABLE IF NOT EXISTS task_stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        cursor.execute('CREATE TABLE IF NOT EXISTS due_stats (day INTEGER PRIMARY KEY, open INTEGER NOT NULL)')
+        cursor.execute('''INSERT OR REPLACE INTO task_stats (name, value)
+                          SELECT 'total', COUNT(*) FROM task_list UNION ALL
+                          SELECT 'finished', COUNT(*) FROM task_list WHERE finished = 1 UNION ALL
+                          SELECT 'archived', COUNT(*) FROM archive''')
+        cursor.execute('DELETE FROM due_stats')
+        cursor.execute('''INSERT INTO due_stats (day, open)
+                          SELECT due, COUNT(*) FROM task_list WHERE finished = 0 AND due IS NOT NULL GROUP BY due''')
+        for trigger in STATS_TRIGGERS:
+            cursor.execute(trigger)
+
+    def create_revs(self):
+        """ Adds `rev` to the task list, and the triggers that keep it up to
+            date. Tasks already in the list count as changed in revision 0 """
+        cursor = self.db_connection.cursor()
+        cursor.execute('ALTER TABLE task_list ADD COLUMN rev INTEGER NOT NULL DEFAULT 0')
+        cursor.execute('CREATE INDEX IF NOT EXISTS task_list_rev ON task_list (rev)')
+        for trigger in REV_TRIGGERS:
+            cursor.execute(trigger)
+
+    def create_changes(self):
+        """ Gives every task a uid, and creates the log of changes that
+            sync sends between task lists. Tasks already in the task list
+            (and archive) get a uid made from their ID, when they were added
+            and their title, so copies of the same database agree on them,
+            and are logged as added (or archived) so a sync since 0 sends
+            the whole task list """
+        import hashlib
+        cursor = self.db_connection.cursor()
+        write_cursor = self.db_connection.cursor()
+
+        cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('origin', lower(hex(randomblob(8))))")
+        for table, id_column in (('task_list', 'id'), ('archive', 'task_id')):
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN uid TEXT')
+            cursor.execute(f'SELECT id, {id_column}, date, title FROM {table}')
+            while True:
+                rows = cursor.fetchmany(MIGRATION_BATCH_SIZE)
+                if not rows:
+                    break
+                write_cursor.executemany(f'UPDATE {table} SET uid = ? WHERE id = ?',
+                                         [(hashlib.sha1(f'{task_id}:{added}:{title}'.encode('utf-8')).hexdigest()[:32], row_id)
+                                          for row_id, task_id, added, title in rows])
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS task_list_uid ON task_list (uid)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS archive_uid ON archive (uid)')
+
+        cursor.execute('''CREATE TABLE IF NOT EXISTS changes
+                          (seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                          uid TEXT NOT NULL,
+                          op TEXT NOT NULL,
+                          payload TEXT,
+                          ts REAL NOT NULL,
+                          origin TEXT NOT NULL)''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS changes_uid ON changes (uid, ts)')
+        for table, op, archived in (('task_list', 'add', 0), ('archive', 'archive', 1)):
+            cursor.execute(f'''INSERT INTO changes (uid, op, payload, ts, origin)
+                               SELECT uid, ?, json_object('date', date, 'title', title, 'description', description, 'due', due,
+                                                          'finished', finished, 'archived', ?), {CHANGE_TS}, {ORIGIN}
+                               FROM {table} ORDER BY id''', (op, archived))
+        for trigger in CHANGE_TRIGGERS:
+            cursor.execute(trigger)
+
+    def create_repeats(self):
+        """ Adds `repeat` (how often a task repeats, see dates.to_repeat) to
+            the task list and the archive. The rev and change log triggers
+            watch it too, so they're created again """
+        cursor = self.db_connection.cursor()
+        cursor.execute('ALTER TABLE task_list ADD COLUMN repeat TEXT')
+        cursor.execute('ALTER TABLE archive ADD COLUMN repeat TEXT')
+        for trigger in ('task_rev_update', 'task_changes_insert', 'task_changes_update', 'task_changes_delete'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        for trigger in REV_TRIGGERS + CHANGE_TRIGGERS:
+            cursor.execute(trigger)
+
+    def use_autoincrement(self, table):
+        """ Rebuilds a table created with a plain INTEGER PRIMARY KEY as one
+            with AUTOINCREMENT. Without it SQLite hands the ID of the newest
+            row out again once that row is removed, so a task (or archived
+            task) could be mistaken for one that's gone. The table's indexes
+            and triggers are created again as they were. New task IDs also
+            stay clear of the IDs archived tasks had """
+        cursor = self.db_connection.cursor()
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+        sql = cursor.fetchone()[0]
+        if 'AUTOINCREMENT' not in sql.upper():
+            cursor.execute("SELECT sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = ? AND sql IS NOT NULL",
+                           (table,))
+            dependents = [dependent for (dependent,) in cursor.fetchall()]
+            columns = sql[sql.index('('):].replace('INTEGER PRIMARY KEY', 'INTEGER PRIMARY KEY AUTOINCREMENT', 1)
+
+            # Triggers on other tables that mention this one would stop the
+            # rename otherwise
+            cursor.execute('PRAGMA legacy_alter_table = ON')
+            cursor.execute(f'CREATE TABLE {table}_new {columns}')
+            cursor.execute(f'INSERT INTO {table}_new SELECT * FROM {table}')
+            cursor.execute(f'DROP TABLE {table}')
+            cursor.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+            cursor.execute('PRAGMA legacy_alter_table = OFF')
+            for dependent in dependents:
+                cursor.execute(dependent)
+
+        if table == 'task_list':
+            cursor.execute('''INSERT INTO sqlite_sequence (name, seq) SELECT 'task_list', 0
+                              WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'task_list')''')
+            cursor.execute('''UPDATE sqlite_sequence SET seq = MAX(seq, (SELECT COALESCE(MAX(task_id), 0) FROM archive))
+                              WHERE name = ?''', (table,))
+
+    def count_new_tasks(self, last_id):
+        """ Adds the tasks after last_id to the stats in one go, for when
+            they were added without the stats insert trigger """
         cursor = self.db_connection.cursor()
-        cursor.execute('UPDATE task_list SET finished = 1 WHERE ROWID = (?)', (row_id,))
+        cursor.execute('''UPDATE task_stats SET value = value + (SELECT COUNT(*) FROM task_list
+                                                                 WHERE id > ?1 AND (task_stats.name = 'total' OR finished = 1))
+                          WHERE name IN ('total', 'finished')''', (last_id,))
+        cursor.execute('''INSERT INTO due_stats (day, open)
+                          SELECT due, COUNT(*) FROM task_list WHERE id > ? AND finished = 0 AND due IS NOT NULL GROUP BY due
+                          ON CONFLICT (day) DO UPDATE SET open = open + excluded.open''', (last_id,))
+
+    def log_new_tasks(self, last_id):
+        """ Logs the tasks after last_id as added in one go, for when they
+            were added without the change log's insert trigger """
+        self.db_connection.execute(f'''INSERT INTO changes (uid, op, payload, ts, origin)
+                                       SELECT uid, 'add', json_object('date', date, 'title', title, 'description', description,
+                                                                      'due', due, 'finished', finished, 'repeat', repeat,
+                                                                      'archived', 0),
+                                              {CHANGE_TS}, {ORIGIN}
+                                       FROM task_list WHERE id > ? ORDER BY id''', (last_id,))
+
+    def commit(self):
+        """ Commits a change to the task list. Every write goes through here:
+            the revision is bumped in the same transaction, and the rendered
+            view cache (see cache.py) is thrown away """
+        self.db_connection.execute("UPDATE meta SET value = value + 1 WHERE key = 'revision'")
         self.db_connection.commit()
+        cache.invalidate(cache.cache_path(self.db_file))
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """ Runs the block as one write transaction, begun with BEGIN
+            IMMEDIATE; the block commits it. If the block raises, everything
+            it wrote is rolled back before the error is passed on, so the
+            write lock is never left held by a long lived process """
+        self.db_connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self.db_connection.rollback()
+            raise
+
+    def get_data_version(self):
+        """ Returns a number that changes whenever another connection commits
+            a change to the database """
+        cursor = self.db_connection.cursor()
+        cursor.execute('PRAGMA data_version')
+        return cursor.fetchone()[0]
+
+    def get_revision(self):
+        """ Returns a number that changes whenever the task list is changed """
+        return self.get_meta('revision')
+
+    def get_meta(self, key, default=None):
+        """ Returns a value stored in the meta table """
+        cursor = self.db_connection.cursor()
+        cursor.execute('SELECT value FROM meta WHERE key = ?', (key,))
+        row = cursor.fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        """ Stores a value in the meta table, as part of the current
+            transaction. A value of None removes the key """
+        if value is None:
+            self.db_connection.execute('DELETE FROM meta WHERE key = ?', (key,))
+        else:
+            self.db_connection.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def add_task(self, title, description, due, finished=0, repeat=None):
+        """ Adds a brand new task to the database. The due date may be typed
+            by the user, a date, a day number or empty. A repeating task (see
+            dates.to_repeat) is first due on its due date, or today if it
+            has none. Returns the new task's stable ID """
+        row = (title, description) + self.due_and_repeat(due, repeat) + (finished,)
+        cursor = self.db_connection.cursor()
+        with self.transaction():
+            cursor.execute('INSERT INTO task_list (title, description, due, repeat, finished) VALUES (?, ?, ?, ?, ?)', row)
+            self.commit()
+        return cursor.lastrowid
+
+    @staticmethod
+    def due_and_repeat(due, repeat):
+        """ Converts a task's due date and repeat rule as given into what's
+            stored. Repeating tasks always have a due date: their next
+            occurrence. A rule that doesn't say which day it counts from
+            counts from the due date """
+        due = dates.to_day(due)
+        first_day = dates.today() if due is None else due
+        repeat = dates.to_repeat(repeat, first_day)
+        if repeat is not None and due is None:
+            due = first_day
+        return due, repeat
+
+    def add_tasks(self, tasks):
+        """ Adds many (title, description, due, finished) tasks at once.
+            Every due date is checked before anything is written, then every
+            task is written in a single transaction """
+        rows = [(title, description, dates.to_day(due), finished) for title, description, due, finished in tasks]
+        cursor = self.db_connection.cursor()
+        with self.transaction():
+            cursor.executemany(f'INSERT INTO task_list (title, description, due, finished, rev) VALUES (?, ?, ?, ?, {NEXT_REV})', rows)
+            self.commit()
+        return cursor.rowcount
 
-    def unfinish_task(self, row_id):
+    def import_tasks(self, chunks, progress_key=None, imported=0):
+        """ Adds chunks of (added, title, description, due, finished, repeat) rows,
+            committing after each chunk so memory use stays bounded. With a
+            progress_key, the running total is saved in the meta table in
+            the same transaction, so an interrupted import can pick up where
+            it stopped; `imported` is where it starts counting from. Yields
+            the total after each chunk """
+        cursor = self.db_connection.cursor()
+        for chunk in chunks:
+            with self.transaction():
+                # Indexing, counting and logging a whole chunk in a few
+                # statements is several times faster than the insert triggers
+                # doing it row by row. The triggers are only missing inside this
+                # transaction, so no other connection ever sees them gone
+                cursor.execute('DROP TRIGGER task_stats_insert')
+                cursor.execute('DROP TRIGGER task_changes_insert')
+                if self.has_fts:
+                    cursor.execute('DROP TRIGGER task_fts_insert')
+                cursor.execute('SELECT COALESCE(MAX(id), 0) FROM task_list')
+                last_id = cursor.fetchone()[0]
+                rev = self.get_revision() + 1
+
+                cursor.executemany('INSERT INTO task_list (date, title, description, due, finished, repeat, rev, uid) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                   (row + (rev, uid) for row, uid in zip(chunk, make_uids(len(chunk)))))
+                imported += len(chunk)
+
+                if self.has_fts:
+                    cursor.execute('INSERT INTO task_fts (rowid, title, description) SELECT id, title, description FROM task_list WHERE id > ?', (last_id,))
+                    cursor.execute(FTS_INSERT_TRIGGER)
+                self.count_new_tasks(last_id)
+                cursor.execute(STATS_INSERT_TRIGGER)
+                self.log_new_tasks(last_id)
+                cursor.execute(CHANGE_INSERT_TRIGGER)
+                if progress_key is not None:
+                    self.set_meta(progress_key, imported)
+                self.commit()
+            yield imported
+
+        if progress_key is not None:
+            self.set_meta(progress_key, None)
+            self.db_connection.commit()
+
+    def remove_task(self, task_id):
+        """ Removes a task from the task list given its stable ID """
+        self.remove_tasks((task_id,))
+
+    def remove_tasks(self, task_ids):
+        """ Removes every task with one of the given stable IDs in a single
+            transaction. Returns how many were removed """
+        task_ids = json.dumps(list(task_ids))
+        cursor = self.db_connection.cursor()
+        with self.transaction():
+            cursor.execute('DELETE FROM task_list WHERE id IN (SELECT value FROM json_each(?))', (task_ids,))
+            self.commit()
+        return cursor.rowcount
+
+    def compact(self):
+        """ Rebuilds the database file to reclaim the space left behind by
+            removed tasks. Task IDs are unaffected """
+        self.db_connection.execute('VACUUM')
+        self.db_connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def finish_task(self, task_id):
+        """ Changes a task from being unfinished to finished """
+        self.finish_tasks((task_id,))
+
+    def unfinish_task(self, task_id):
         """ Changes a task from being finished to unfinished """
+        self.unfinish_tasks((task_id,))
+
+    def finish_tasks(self, task_ids):
+        """ Finishes every task with one of the given stable IDs in a single
+            transaction. Returns how many were changed """
+        return self.set_finished(task_ids, 1)
+
+    def unfinish_tasks(self, task_ids):
+        """ Unfinishes every task with one of the given stable IDs in a single
+            transaction. Returns how many were changed """
+        return self.set_finished(task_ids, 0)
+
+    def set_finished(self, task_ids, finished):
+        """ Marks tasks as finished (1) or unfinished (0). Finishing a
+            repeating task only finishes its next occurrence (see
+            finish_occurrences) """
+        task_ids = json.dumps(list(task_ids))
         cursor = self.db_connection.cursor()
-        cursor.execute('UPDATE task_list SET finished = 0 WHERE ROWID = (?)', (row_id,))
-        self.db_connection.commit()
+        with self.transaction():
+            changed = self.finish_occurrences(task_ids) if finished else 0
+            # Repeating tasks were finished an occurrence at a time
+            once = 'AND repeat IS NULL' if finished else ''
+            cursor.execute(f'UPDATE task_list SET finished = ? WHERE finished != ? {once} AND id IN (SELECT value FROM json_each(?))',
+                           (finished, finished, task_ids))
+            changed += cursor.rowcount
+            self.commit()
+        return changed
 
-    def update_task(self, row_id, title, description, due, finished):
+    def finish_occurrences(self, task_ids):
+        """ Finishes the next occurrence of each open repeating task with
+            one of the given stable IDs (a JSON list), as part of the current
+            transaction. The occurrence becomes a finished task of its own,
+            added to the end of the task list, and the repeating task moves
+            on to its first occurrence after today (or after the one finished,
+            if that was early), counted from the day its rule counts from so
+            monthly tasks keep to their day. Returns how many were finished """
+        today = dates.today()
+        cursor = self.db_connection.cursor()
+        cursor.execute('''SELECT id, title, description, due, repeat FROM task_list
+                          WHERE repeat IS NOT NULL AND finished = 0 AND id IN (SELECT value FROM json_each(?)) ORDER BY id''', (task_ids,))
+        # A sync can leave a repeating task without a due date, it's taken
+        # to be due today
+        tasks = [(task_id, title, description, today if due is None else due, repeat)
+                 for task_id, title, description, due, repeat in cursor.fetchall()]
+        cursor.executemany('INSERT INTO task_list (title, description, due, finished) VALUES (?, ?, ?, 1)',
+                           ((title, description, due) for task_id, title, description, due, repeat in tasks))
+        # Rules stored before they said which day they count from start
+        # counting from the occurrence finished
+        cursor.executemany('UPDATE task_list SET due = ?, repeat = ? WHERE id = ?',
+                           ((dates.next_occurrence(due, repeat, max(due, today)), dates.to_repeat(repeat, due), task_id)
+                            for task_id, title, description, due, repeat in tasks))
+        return len(tasks)
+
+    def update_task(self, task_id, title, description, due, finished, repeat=None):
         """ Updates an existing task in the task list """
+        self.update_tasks(((task_id, title, description, due, finished, repeat),))
+
+    def update_tasks(self, tasks):
+        """ Updates many (task_id, title, description, due, finished, repeat)
+            tasks in a single transaction, once every due date and repeat
+            rule has been checked. Returns how many were found """
+        rows = [(title, description) + self.due_and_repeat(due, repeat) + (finished, task_id)
+                for task_id, title, description, due, finished, repeat in tasks]
         cursor = self.db_connection.cursor()
-        cursor.execute('''UPDATE task_list SET
-                            title = ?,
-                            description = ?,
-                            due = ?,
-                            finished = ?
-                          WHERE ROWID = ?''', (title, description, due, finished, row_id,))
-        self.db_connection.commit()
+        with self.transaction():
+            cursor.executemany('''UPDATE task_list SET
+                                    title = ?,
+                                    description = ?,
+                                    due = ?,
+                                    repeat = ?,
+                                    finished = ?
+                                  WHERE id = ?''', rows)
+            self.commit()
+        return cursor.rowcount
 
-    def get_num_tasks(self):
-        """ Returns the number of tasks in the task list """
+    def archive_tasks(self, days):
+        """ Moves tasks finished at least `days` days ago to the archive,
+            ARCHIVE_BATCH_SIZE tasks per transaction. Tasks finished before
+            finishing was timed count from when they were added. Returns
+            how many tasks were archived """
+        now = int(time.time())
+        cutoff = now - days * 86400
         cursor = self.db_connection.cursor()
-        cursor.execute('SELECT COUNT(*) FROM task_list')
+        archived = 0
+
+        while True:
+            with self.transaction():
+                cursor.execute('SELECT id FROM task_list WHERE finished = 1 AND COALESCE(finished_at, date) <= ? ORDER BY id LIMIT ?',
+                               (cutoff, ARCHIVE_BATCH_SIZE))
+                task_ids = json.dumps([task_id for (task_id,) in cursor.fetchall()])
+                cursor.execute('''INSERT INTO archive (task_id, uid, date, title, description, due, finished, repeat, finished_at, archived_at)
+                                  SELECT id, uid, date, title, description, due, finished, repeat, finished_at, ? FROM task_list
+                                  WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id''', (now, task_ids))
+                moved = cursor.rowcount
+                if moved == 0:
+                    self.set_meta('archived_at', now)
+                    self.db_connection.commit()
+                    return archived
+
+                cursor.execute('DELETE FROM task_list WHERE id IN (SELECT value FROM json_each(?))', (task_ids,))
+                self.commit()
+            archived += moved
+
+    def archive_if_due(self, days):
+        """ Archives old finished tasks (see archive_tasks) if it hasn't been
+            done in the last ARCHIVE_INTERVAL seconds. Returns how many tasks
+            were archived """
+        if days is None or time.time() - self.get_meta('archived_at', 0) < ARCHIVE_INTERVAL:
+            return 0
+        return self.archive_tasks(days)
+
+    def restore_tasks(self, archive_ids):
+        """ Moves tasks with the given archive IDs back to the task list in
+            a single transaction. They get their old ID back unless a task has
+            it (or an earlier task restored along with them had the same old ID,
+            as tasks archived before IDs stopped being reused can). They count as just
+            finished, so they aren't archived again straight away. Returns how
+            many were restored """
+        archive_ids = json.dumps(list(archive_ids))
+        cursor = self.db_connection.cursor()
+        with self.transaction():
+            cursor.execute('''INSERT INTO task_list (id, uid, date, title, description, due, finished, repeat, finished_at)
+                              SELECT CASE WHEN EXISTS (SELECT 1 FROM task_list WHERE id = archive.task_id)
+                                            OR EXISTS (SELECT 1 FROM archive AS earlier WHERE earlier.task_id = archive.task_id
+                                                       AND earlier.id < archive.id AND earlier.id IN (SELECT value FROM json_each(?1)))
+                                          THEN NULL ELSE task_id END,
+                                     uid, date, title, description, due, finished, repeat, CAST(strftime('%s', 'now') AS INTEGER)
+                              FROM archive WHERE id IN (SELECT value FROM json_each(?1)) ORDER BY id''', (archive_ids,))
+            restored = cursor.rowcount
+            cursor.execute('DELETE FROM archive WHERE id IN (SELECT value FROM json_each(?))', (archive_ids,))
+            self.commit()
+        return restored
+
+    def iter_change_log(self, since, chunk_size):
+        """ Yields lists of the changes logged after sequence number `since`,
+            oldest first, as (seq, uid, op, payload, ts, origin) rows with
+            the payload still JSON text """
+        cursor = self.db_connection.cursor()
+        cursor.execute('SELECT seq, uid, op, payload, ts, origin FROM changes WHERE seq > ? ORDER BY seq', (since,))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield rows
+
+    def apply_changes(self, changes):
+        """ Applies (uid, op, payload, ts, origin) changes logged by another
+            copy of the task list (see iter_change_log) in one transaction,
+            logging them here as they were made there. Each field of a task
+            ends up as it was set by the latest change to it, wherever that
+            was made; removing a task wins over any change to it. Changes
+            already applied are passed over, as are changes to tasks that
+            haven't been added here yet (apply the changes that added them
+            first). Returns how many changes were applied """
+        cursor = self.db_connection.cursor()
+        with self.transaction():
+            self.set_meta('syncing', 1)
+            applied = 0
+            for uid, op, payload, ts, origin in changes:
+                if self.apply_change(cursor, uid, op, payload, ts, origin):
+                    cursor.execute('INSERT INTO changes (uid, op, payload, ts, origin) VALUES (?, ?, ?, ?, ?)',
+                                   (uid, op, None if payload is None else json.dumps(payload), ts, origin))
+                    applied += 1
+            self.set_meta('syncing', None)
+            self.commit()
+        return applied
+
+    def apply_change(self, cursor, uid, op, payload, ts, origin):
+        """ Carries out one change for apply_changes. Returns False if it
+            was passed over """
+        cursor.execute('SELECT op, payload, ts, origin FROM changes WHERE uid = ?', (uid,))
+        logged = [(logged_op, None if logged_payload is None else json.loads(logged_payload), logged_ts, logged_origin)
+                  for logged_op, logged_payload, logged_ts, logged_origin in cursor.fetchall()]
+        if (op, payload, ts, origin) in logged or any(logged_op == 'remove' for logged_op, *rest in logged):
+            return False
+
+        if op == 'remove':
+            cursor.execute('DELETE FROM task_list WHERE uid = ?', (uid,))
+            cursor.execute('DELETE FROM archive WHERE uid = ?', (uid,))
+            return True
+
+        # Fields changed here by a later change keep their value
+        newer = set()
+        for logged_op, logged_payload, logged_ts, logged_origin in logged:
+            if logged_payload is not None and (logged_ts, logged_origin) > (ts, origin):
+                newer.update(logged_payload)
+        fields = {name: value for name, value in payload.items() if name not in newer}
+
+        cursor.execute("SELECT 'task_list' FROM task_list WHERE uid = ?1 UNION ALL SELECT 'archive' FROM archive WHERE uid = ?1", (uid,))
+        row = cursor.fetchone()
+        if row is None:
+            if any(name not in payload for name in NEW_TASK_FIELDS):
+                return False
+            table = self.task_table(payload['archived'])
+            columns = ', '.join(SYNCED_FIELDS)
+            values = [payload.get(name) for name in SYNCED_FIELDS]
+            if table == 'task_list':
+                cursor.execute(f'INSERT INTO task_list (uid, {columns}) VALUES (?{", ?" * len(values)})', [uid] + values)
+            else:
+                cursor.execute(f'''INSERT INTO archive (task_id, uid, {columns}, archived_at)
+                                   VALUES ((SELECT COALESCE(MAX(id), 0) + 1 FROM task_list), ?{", ?" * len(values)}, ?)''', [uid] + values + [int(ts)])
+            return True
+
+        table = row[0]
+        if 'archived' in fields and self.task_table(fields['archived']) != table:
+            table = self.move_task(cursor, uid, table, ts)
+
+        changed = [name for name in SYNCED_FIELDS if name in fields]
+        if changed:
+            cursor.execute(f'UPDATE {table} SET {", ".join(name + " = ?" for name in changed)} WHERE uid = ?',
+                           [fields[name] for name in changed] + [uid])
+        return True
+
+    def move_task(self, cursor, uid, table, ts):
+        """ Moves a task between the task list and the archive for
+            apply_change, like archive_tasks and restore_tasks do. Returns
+            the table it's in now """
+        if table == 'task_list':
+            cursor.execute('''INSERT INTO archive (task_id, uid, date, title, description, due, finished, repeat, finished_at, archived_at)
+                              SELECT id, uid, date, title, description, due, finished, repeat, finished_at, ? FROM task_list WHERE uid = ?''',
+                           (int(ts), uid))
+            cursor.execute('DELETE FROM task_list WHERE uid = ?', (uid,))
+            return 'archive'
+
+        cursor.execute('''INSERT INTO task_list (id, uid, date, title, description, due, finished, repeat, finished_at)
+                          SELECT CASE WHEN EXISTS (SELECT 1 FROM task_list WHERE id = archive.task_id) THEN NULL ELSE task_id END,
+                                 uid, date, title, description, due, finished, repeat, CAST(strftime('%s', 'now') AS INTEGER)
+                          FROM archive WHERE uid = ?''', (uid,))
+        cursor.execute('DELETE FROM archive WHERE uid = ?', (uid,))
+        return 'task_list'
+
+    def get_num_tasks(self, archived=False):
+        """ Returns the number of tasks in the task list (or the archive),
+            as counted by the stats triggers """
+        cursor = self.db_connection.cursor()
+        cursor.execute('SELECT value FROM task_stats WHERE name = ?', ('archived' if archived else 'total',))
         num = cursor.fetchone()
 
         return num[0]
 
-    def get_tasks(self):
-        """ Returns a list of each row in the database (corresponds to tasks) """
+    def has_tasks(self):
+        """ Returns True if there's at least one task """
+        return self.get_num_tasks() > 0
+
+    def get_stats(self):
+        """ Returns how many tasks there are in total, open, finished, open
+            and overdue, open and due today, and archived. Everything is read
+            from the tables the stats triggers keep, in one statement, so
+            this takes no longer for a longer task list """
+        today = dates.today()
+        cursor = self.db_connection.cursor()
+        cursor.execute('''SELECT (SELECT value FROM task_stats WHERE name = 'total'),
+                                 (SELECT value FROM task_stats WHERE name = 'finished'),
+                                 (SELECT COALESCE(SUM(open), 0) FROM due_stats WHERE day < ?),
+                                 (SELECT COALESCE(SUM(open), 0) FROM due_stats WHERE day = ?),
+                                 (SELECT value FROM task_stats WHERE name = 'archived')''', (today, today))
+        total, finished, overdue, due_today, archived = cursor.fetchone()
+        return {
+            'total': total,
+            'open': total - finished,
+            'finished': finished,
+            'overdue': overdue,
+            'due_today': due_today,
+            'archived': archived
+        }
+
+    @staticmethod
+    def task_table(archived):
+        """ Returns the table holding archived or current tasks """
+        return 'archive' if archived else 'task_list'
+
+    def task_cursor(self):
+        """ Returns a cursor that builds a Task from each row it fetches """
         cursor = self.db_connection.cursor()
-        cursor.execute('SELECT ROWID, * FROM task_list')
+        cursor.row_factory = Task.from_row
+        return cursor
+
+    def get_tasks(self, **filters):
+        """ Returns a list of each row in the database (corresponds to tasks).
+            The ID shown to the user is the task's position in the list,
+            see resolve_id for mapping it back to the stable ID. Accepts the
+            same keyword filters as task_filter """
+        table = self.task_table(filters.get('archived'))
+        where, params = self.task_filter(**filters)
+        cursor = self.task_cursor()
+        cursor.execute(f'SELECT {TASK_COLUMNS} FROM {table} {where} ORDER BY id', params)
+
+        tasks = cursor.fetchall()
+
+        if not where:
+            for position, task in enumerate(tasks, start=1):
+                task.position = position
+            return tasks
+        return self.number_tasks(tasks, table)
+
+    def iter_task_rows(self, chunk_size):
+        """ Yields every task as (added, title, description, due, finished,
+            repeat) rows, `chunk_size` rows at a time. The rows all come from
+            one cursor, so they're one consistent snapshot of the task list """
+        cursor = self.db_connection.cursor()
+        cursor.execute('SELECT date, title, description, due, finished, repeat FROM task_list ORDER BY id')
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield rows
+
+    def get_task_ids(self):
+        """ Returns the stable ID of every task, in order """
+        cursor = self.db_connection.cursor()
+        cursor.execute('SELECT id FROM task_list ORDER BY id')
+        return [task_id for (task_id,) in cursor.fetchall()]
+
+    def get_changes(self, since, **filters):
+        """ Returns what changed in the task list after revision `since`:
+            the current revision, the number of tasks, the IDs of the tasks
+            added or changed since, and the ones of those that match the
+            filters of task_filter (as Tasks without positions). Everything
+            is read from one snapshot. Removed tasks aren't listed; they show
+            up as the count being lower than expected """
+        where, params = self.task_filter(**filters)
+        changed = f'{where} AND rev > ?' if where else 'WHERE rev > ?'
+        cursor = self.db_connection.cursor()
+        task_cursor = self.task_cursor()
+
+        cursor.execute('BEGIN')
+        try:
+            revision = self.get_revision()
+            count = self.get_num_tasks()
+            cursor.execute('SELECT id FROM task_list WHERE rev > ? ORDER BY id', (since,))
+            changed_ids = [task_id for (task_id,) in cursor.fetchall()]
+            task_cursor.execute(f'SELECT {TASK_COLUMNS} FROM task_list {changed} ORDER BY id', params + [since])
+            tasks = task_cursor.fetchall()
+        finally:
+            # Only ends the read transaction
+            self.db_connection.commit()
+        return revision, count, changed_ids, tasks
+
+    def get_task(self, task_id):
+        """ Returns the task with the given stable ID, or None """
+        cursor = self.task_cursor()
+        cursor.execute(f'SELECT {TASK_COLUMNS} FROM task_list WHERE id = ?', (task_id,))
+        task = cursor.fetchone()
+
+        if task is None:
+            return None
+        return self.number_tasks([task])[0]
+
+    def iter_task_pages(self, limit, page=1, **filters):
+        """ Yields the task list `limit` tasks at a time, starting at the
+            given page. Only the first page is found by offset, every page
+            after it continues from the last ID seen, so each page costs the
+            same no matter how far into the list it is """
+        table = self.task_table(filters.get('archived'))
+        where, params = self.task_filter(**filters)
+        keyset = f'{where} AND id > ?' if where else 'WHERE id > ?'
+        cursor = self.task_cursor()
+        position = (page - 1) * limit
+        cursor.execute(f'SELECT {TASK_COLUMNS} FROM {table} {where} ORDER BY id LIMIT ? OFFSET ?', params + [limit, position])
 
-        initial_data = cursor.fetchall() # Returns list of rows, where each row is a tuple
+        while True:
+            tasks = cursor.fetchall()
+            if not tasks:
+                return
 
-        # Convert list of tuples to dict and add a row id to each task
-        tasks = []
-        for task in initial_data:
-            new_task = {}
+            if where:
+                self.number_tasks(tasks, table)
+            else:
+                for task in tasks:
+                    position += 1
+                    task.position = position
+            yield tasks
 
-            new_task['ID'] = task[0]
-            new_task['Added'] = task[1]
-            new_task['Title'] = task[2]
-            new_task['Description'] = task[3]
-            new_task['Due'] = task[4]
-            new_task['Finished?'] = task[5]
+            if len(tasks) < limit:
+                return
+            cursor.execute(f'SELECT {TASK_COLUMNS} FROM {table} {keyset} ORDER BY id LIMIT ?', params + [tasks[-1].id, limit])
 
-            tasks.append(new_task)
+    def task_filter(self, status=None, due_before=None, due_after=None, search=None, archived=False):
+        """ Builds the WHERE clause (and its parameters) that narrows the task
+            list down. Due dates are given as day numbers (see dates.to_day).
+            Every condition can be answered from an index. `archived` picks
+            the archive instead of the task list (see task_table), which
+            has no full text index so it's searched with a scan """
+        conditions = []
+        params = []
+
+        if status is not None:
+            conditions.append('finished = ?')
+            params.append(STATUSES[status])
+        if due_before is not None:
+            conditions.append('due < ?')
+            params.append(due_before)
+        if due_after is not None:
+            conditions.append('due > ?')
+            params.append(due_after)
+        if search and search.split():
+            if self.has_fts and not archived:
+                conditions.append('id IN (SELECT rowid FROM task_fts WHERE task_fts MATCH ?)')
+                params.append(self.fts_query(search))
+            else:
+                conditions.append("(title LIKE ? ESCAPE '\\' OR description LIKE ? ESCAPE '\\')")
+                pattern = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                params.extend([pattern, pattern])
+
+        if not conditions:
+            return '', params
+        return 'WHERE ' + ' AND '.join(conditions), params
+
+    @staticmethod
+    def fts_query(search):
+        """ Turns the user's search into an FTS5 query that matches tasks
+            containing every word (or a word starting with it) """
+        words = search.split()
+        return ' '.join('"' + word.replace('"', '""') + '"*' for word in words)
+
+    def number_tasks(self, tasks, table='task_list'):
+        """ Works out the position in the whole task list (or archive) of
+            each task of a filtered result, so the IDs shown match the
+            unfiltered list. Tasks must be in ID order; the counts only ever
+            move forward """
+        cursor = self.db_connection.cursor()
+        position = 0
+        previous_id = None
+
+        for task in tasks:
+            if previous_id is None:
+                cursor.execute(f'SELECT COUNT(*) FROM {table} WHERE id <= ?', (task.id,))
+            else:
+                cursor.execute(f'SELECT COUNT(*) FROM {table} WHERE id > ? AND id <= ?', (previous_id, task.id))
+            position += cursor.fetchone()[0]
+            previous_id = task.id
+            task.position = position
 
         return tasks
 
-    def verify_id(self, row_id):
-        """ Returns true if there is a row in the database that matches
-            the task ID the user gave, False otherwise """
+    def resolve_id(self, display_id):
+        """ Translates the ID shown next to a task into its stable ID.
+            Returns None if no task is shown with that ID """
+        try:
+            position = int(display_id)
+        except (TypeError, ValueError):
+            return None
+        if position < 1:
+            return None
+
         cursor = self.db_connection.cursor()
-        cursor.execute('SELECT COUNT(*) FROM task_list where ROWID=(?)', (row_id,))
-        num_count = cursor.fetchone()
+        cursor.execute('SELECT id FROM task_list ORDER BY id LIMIT 1 OFFSET ?', (position - 1,))
+        row = cursor.fetchone()
 
-        # If there are no matching ID's, it must not be a valid task ID
-        if num_count[0] == 0:
-            return False
-        return True
+        return row[0] if row else None
+
+    def resolve_ids(self, ranges=None, **filters):
+        """ Translates many IDs shown next to tasks into stable IDs with one
+            query. `ranges` is a sorted list of (first, last) ranges of shown
+            IDs that don't overlap (see store.to_ranges), or None for every
+            task. Accepts the same keyword filters as task_filter. Returns
+            (position, stable ID) pairs for the tasks that exist and match.
+            Positions are None when every task was asked for, since nothing
+            has to be numbered then """
+        table = self.task_table(filters.get('archived'))
+        where, params = self.task_filter(**filters)
+        cursor = self.db_connection.cursor()
+
+        if ranges is None:
+            cursor.execute(f'SELECT NULL, id FROM {table} {where} ORDER BY id', params)
+            return cursor.fetchall()
+        if not ranges:
+            return []
+
+        # Only the tasks from the first to the last position asked for are
+        # numbered. The ones before them are skipped over by offset
+        first, last = ranges[0][0], ranges[-1][1]
+        conditions = []
+        if len(ranges) > 1:
+            conditions.append('''EXISTS (SELECT 1 FROM json_each(?)
+                                         WHERE position BETWEEN json_extract(value, '$[0]') AND json_extract(value, '$[1]'))''')
+            params = [json.dumps(ranges)] + params
+        if where:
+            conditions.append(f'id IN (SELECT id FROM {table} {where})')
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        cursor.execute(f'''SELECT position, id FROM
+                             (SELECT id, ? + ROW_NUMBER() OVER (ORDER BY id) AS position FROM {table}
+                              WHERE id >= (SELECT id FROM {table} ORDER BY id LIMIT 1 OFFSET ?)
+                              ORDER BY id LIMIT ?)
+                           {where}
+                           ORDER BY id''', [first - 1, first - 1, last - first + 1] + params)
+        return cursor.fetchall()
+
+    def verify_id(self, display_id):
+        """ Returns true if there is a row in the database that matches
+            the task ID the user gave, False otherwise """
+        return self.resolve_id(display_id) is not None
@@ -1,12 +1,56 @@
 import os
+import sys
 import math
-import shutil
-import textwrap
-from datetime import datetime
-from terminaltables import AsciiTable
+import time
+from bisect import bisect_right
+from . import dates
+from .models import FormattedRow
+from .table import TableWriter, visible_width, wrap_wide
+
+# terminaltables and textwrap are imported where they're used, so commands
+# that never draw a table don't pay for importing them
+
+# Moves the cursor home and clears the screen and its scrollback
+CLEAR_SCREEN = '\033[H\033[2J\033[3J'
+
+# Column headers of the task table
+TASK_HEADERS = ('ID', 'Added', 'Title', 'Description', 'Due', 'Finished?')
+
+# Columns that are narrowed (down to this width) to fit the task table in
+# the terminal. Their text is wrapped to whatever width they end up with
+SHRINKABLE_COLUMNS = ('Title', 'Description')
+MIN_SHRINK_WIDTH = 10
+
+# Time Constants
+SECONDS_IN_MIN = 60
+SECONDS_IN_HOUR = 3600
+SECONDS_IN_DAY = 86400
+SECONDS_IN_WEEK = 604800
+SECONDS_IN_MONTH = 2592000
+SECONDS_IN_YEAR = 31536000
+
+# How old a task is, shown as '<count><unit> ago'. A task younger than each
+# limit is counted in that bucket's unit (anything older is in years)
+AGE_LIMITS = (SECONDS_IN_MIN, SECONDS_IN_HOUR, SECONDS_IN_DAY, SECONDS_IN_WEEK, SECONDS_IN_MONTH, SECONDS_IN_YEAR)
+AGE_UNITS = (
+    (1, 's'),
+    (SECONDS_IN_MIN, 'm'),
+    (SECONDS_IN_HOUR, 'h'),
+    (SECONDS_IN_DAY, 'd'),
+    (SECONDS_IN_WEEK, 'w'),
+    (SECONDS_IN_MONTH, 'mo'),
+    (SECONDS_IN_YEAR, 'yr')
+)
+
+# How often a task repeats is shown under its due date, with units
+# shortened like ages are
+REPEAT_SUFFIXES = {'day': 'd', 'week': 'w', 'month': 'mo'}
 
 class Display:
-    def __init__(self):
+    def __init__(self, term_width=None):
+        # Width to lay tables out for. Found from the terminal when not given
+        self.term_width = term_width
+
         self.colors = {
             'RED': '\033[38;5;196m',
             'ORANGE': '\033[38;5;220m',
@@ -28,6 +72,13 @@ class Display:
             'Finished': 1
         }
 
+        # TextWrappers for long columns, created the first time they're needed
+        self.wrappers = {}
+
+        # When the rows formatted so far will first look different (an age
+        # moving on or a due date changing color), in seconds since the epoch
+        self.valid_until = math.inf
+
     def color_message(self, message, *args):
         """ Sets a message to be a specific color from the colors dict before resetting """
         args_list = [str(color) for color in args]
@@ -48,8 +99,29 @@ class Display:
 
     @staticmethod
     def clear_terminal():
-        """ Clears a terminal to prepare for output """
-        os.system('cls' if os.name == 'nt' else 'clear')
+        """ Clears a terminal to prepare for output. Writes the escape codes
+            directly instead of running `clear`, and leaves output that isn't
+            going to a terminal alone """
+        if sys.stdout.isatty():
+            sys.stdout.write(CLEAR_SCREEN)
+
+    def terminal_width(self):
+        """ Returns the width of the terminal the same way as
+            shutil.get_terminal_size, without importing shutil """
+        if self.term_width:
+            return self.term_width
+
+        try:
+            columns = int(os.environ['COLUMNS'])
+        except (KeyError, ValueError):
+            columns = 0
+        if columns > 0:
+            return columns
+
+        try:
+            return os.get_terminal_size(sys.__stdout__.fileno()).columns or 80
+        except (AttributeError, ValueError, OSError):
+            return 80
 
     def print_welcome(self):
         """ Prints a simple welcome message. """
@@ -61,12 +133,15 @@ class Display:
             Shown when the user has an empty task list """
         commands = [[self.color_message(i, 'BOLD') for i in ['Commands', 'Description']],
                     ['-a/--add', 'Add a new element to a task list'],
-                    ['-r/--remove', 'Remove an element from a task list'],
-                    ['-f/--finish', 'Finish a task in a task list'],
-                    ['-u/--unfinish', 'Unfinish a task in a task list'],
+                    ['-r/--remove [IDS]', 'Remove tasks (such as 3,7,10-40) from a task list'],
+                    ['-f/--finish [IDS]', 'Finish tasks in a task list'],
+                    ['-u/--unfinish [IDS]', 'Unfinish tasks in a task list'],
                     ['-c/--change', 'Change parts of an existing task'],
-                    ['-v/--view', 'View the whole task list']]
+                    ['-v/--view', 'View the whole task list'],
+                    ['--stats', 'Count open, overdue and finished tasks'],
+                    ['--compact', 'Reclaim space left by removed tasks']]
         table_data = commands
+        from terminaltables import AsciiTable
         table = AsciiTable(table_data)
         table.inner_row_border = True
 
@@ -77,147 +152,259 @@ class Display:
             print(table.table)
 
     @staticmethod
-    def check_table_fit(table):
+    def format_stats(stats):
+        """ Returns the task counts from DB.get_stats as one plain line, short
+            enough for a shell prompt """
+        line = f'{stats["open"]} open'
+        if stats['overdue'] or stats['due_today']:
+            line += f' ({stats["overdue"]} overdue, {stats["due_today"]} due today)'
+        line += f', {stats["finished"]} finished'
+        if stats['archived']:
+            line += f', {stats["archived"]} archived'
+        return line
+
+    def check_table_fit(self, table):
         """ Returns true if a terminaltable will fit within the width of
             the current terminal width"""
-        term_width = shutil.get_terminal_size().columns
+        term_width = self.terminal_width()
         table_width = table.table_width
         if table_width > term_width:
             return False
         return True
 
-    def format_row(self, tasks):
-        """ Performs formatting tasks such as changing task completions from (0,1) to (X/✓) """
+    def format_row(self, tasks, widths=None):
+        """ Performs formatting tasks such as changing task completions from (0,1) to (X/✓).
+            Returns a FormattedRow for each Task, leaving the tasks untouched.
+            The whole batch is formatted against one snapshot of the current
+            time, and every string that doesn't depend on the task is built once.
+            Long text is wrapped to `widths` (see task_table_layout), or to
+            max_col_widths if not given """
+        widths = widths or self.max_col_widths
+        title_width = widths['Title']
+        description_width = widths['Description']
+
+        now = time.time()
+        today = dates.today()
+
+        # Due dates change color at midnight
+        valid_until = min(self.valid_until, dates.next_midnight())
+
+        finished_mark = self.color_message('✓', 'GREEN', 'BOLD')
+        unfinished_mark = self.color_message('X', 'BOLD', 'RED')
+        overdue_color = self.colors['RED'] + self.colors['BOLD']
+        due_soon_color = self.colors['ORANGE'] + self.colors['BOLD']
+        reset = self.colors['RESET']
+
+        # Most lists reuse a handful of due dates (and ways to repeat)
+        due_dates = {}
+        repeat_labels = {}
+
         formatted_tasks = []
 
         for task in tasks:
-            # Format specific columns
-            title = task['Title']
-            description = task['Description']
-
-            timestamp = task['Added']
-            finished = task['Finished?']
-            due = task['Due']
-
-            formatted_timestamp = self.format_time(timestamp)
-            formatted_finished = self.color_message('✓', 'GREEN', 'BOLD') if finished == 1 else self.color_message('X', 'BOLD', 'RED')
-            formatted_due = self.format_due_date(due, finished)
-
-            # Wrap long lines in the title or description
-            formatted_title = self.format_long_lines(title, 'Title')
-            formatted_description = self.format_long_lines(description, 'Description')
-
-            task['Title'] = formatted_title
-            task['Description'] = formatted_description
-            task['Added'] = formatted_timestamp
-            task['Finished?'] = formatted_finished
-            task['Due'] = formatted_due
-
-            formatted_tasks.append(task)
-
+            finished = task.finished
+            due = task.due
+
+            if due is None:
+                formatted_due = ''
+            else:
+                if due not in due_dates:
+                    due_dates[due] = dates.format_day(due)
+                formatted_due = due_dates[due]
+
+                # Same colors as format_due_date
+                if finished != 1:
+                    if due <= today:
+                        formatted_due = overdue_color + formatted_due + reset
+                    elif due == today + 1:
+                        formatted_due = due_soon_color + formatted_due + reset
+
+            if task.repeat is not None:
+                if task.repeat not in repeat_labels:
+                    repeat_labels[task.repeat] = self.format_repeat(task.repeat)
+                formatted_due += '\n' + repeat_labels[task.repeat]
+
+            age = now - task.added
+            valid_until = min(valid_until, now + self.age_changes_in(age))
+
+            formatted_tasks.append(FormattedRow(str(task.position),
+                                                self.format_age(age),
+                                                self.format_long_lines(task.title, 'Title', title_width),
+                                                self.format_long_lines(task.description, 'Description', description_width),
+                                                formatted_due,
+                                                finished_mark if finished == 1 else unfinished_mark))
+
+        self.valid_until = valid_until
         return formatted_tasks
 
     @staticmethod
     def format_time(timestamp):
-        """ Returns a nice timestamp telling the user how old a task is.
+        """ Returns a nice timestamp telling the user how old a task is,
+            given when it was added in seconds since the epoch.
             Returns strings such as '1d ago' """
-        timestamp_datetime = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
-        curr_time = datetime.now()
-        total_time_diff = curr_time - timestamp_datetime
-
-        # Time Constants
-        SECONDS_IN_MIN = 60
-        SECONDS_IN_HOUR = 3600
-        SECONDS_IN_DAY = 86400
-        SECONDS_IN_WEEK = 604800
-        SECONDS_IN_MONTH = 2592000
-        SECONDS_IN_YEAR = 31536000
-
-        # Print out formatted time difference
-        if total_time_diff.total_seconds() < 10:
-            return f'just now'
-        if total_time_diff.total_seconds() < SECONDS_IN_MIN:
-            seconds_passed = math.floor(total_time_diff.total_seconds())
-            return f'{seconds_passed}s ago'
-        if total_time_diff.total_seconds() < SECONDS_IN_HOUR:
-            minutes_passed = math.floor(total_time_diff.total_seconds() / SECONDS_IN_MIN)
-            return f'{minutes_passed}m ago'
-        if total_time_diff.total_seconds() < SECONDS_IN_DAY:
-            hours_passed = math.floor(total_time_diff.total_seconds() / SECONDS_IN_HOUR)
-            return f'{hours_passed}h ago'
-        if total_time_diff.total_seconds() < SECONDS_IN_WEEK:
-            days_passed = math.floor(total_time_diff.total_seconds() / SECONDS_IN_DAY)
-            return f'{days_passed}d ago'
-        if total_time_diff.total_seconds() < SECONDS_IN_MONTH:
-            weeks_passed = math.floor(total_time_diff.total_seconds() / SECONDS_IN_WEEK)
-            return f'{weeks_passed}w ago'
-        if total_time_diff.total_seconds() < SECONDS_IN_YEAR:
-            months_passed = math.floor(total_time_diff.total_seconds() / SECONDS_IN_MONTH)
-            return f'{months_passed}mo ago'
-        years_passed = math.floor(total_time_diff.total_seconds() / SECONDS_IN_YEAR)
-        return f'{years_passed}yr ago'
+        return Display.format_age(time.time() - timestamp)
+
+    @staticmethod
+    def format_age(seconds_since):
+        """ Formats a number of seconds as a relative age such as '1d ago' """
+        if seconds_since < 10:
+            return 'just now'
+        unit, suffix = AGE_UNITS[bisect_right(AGE_LIMITS, seconds_since)]
+        return f'{math.floor(seconds_since / unit)}{suffix} ago'
+
+    @staticmethod
+    def age_changes_in(seconds_since):
+        """ Returns how many seconds until format_age gives a different
+            answer for something that is seconds_since old """
+        if seconds_since < 10:
+            return 10 - seconds_since
+        bucket = bisect_right(AGE_LIMITS, seconds_since)
+        unit = AGE_UNITS[bucket][0]
+        changes_in = unit - seconds_since % unit
+        if bucket < len(AGE_LIMITS):
+            # Buckets don't always end on a whole number of units (a month
+            # isn't a whole number of weeks)
+            changes_in = min(changes_in, AGE_LIMITS[bucket] - seconds_since)
+        return changes_in
+
+    @staticmethod
+    def format_repeat(rule):
+        """ Shortens how often a task repeats to fit in the due date column,
+            such as 'weekly' or 'every 2w' """
+        count, unit, anchor = dates.parse_repeat(rule)
+        if count == 1:
+            return next(name for name, named_unit in dates.REPEAT_NAMES.items() if named_unit == unit)
+        return f'every {count}{REPEAT_SUFFIXES[unit]}'
 
     @staticmethod
     def validate_date(date_str):
         """ Ensures that the date given is in an acceptable format """
-        for date_format in ('%m/%d/%Y', '%m-%d-%Y'):
-            try:
-                if datetime.strptime(date_str, date_format):
-                    return True
-            except ValueError:
-                pass
-        return False
+        try:
+            dates.parse_date(date_str)
+        except ValueError:
+            return False
+        return True
 
-    def format_due_date(self, due_date, finished):
+    def format_due_date(self, due_day, finished):
         """ Formats the due date column to be colored based on how close
             the task is to its due date. (Red = overdue, etc...)"""
+        due_date = dates.format_day(due_day)
+
         # Don't format tasks that don't have a due date or are finished
-        if due_date == '' or finished == 1:
+        if due_day is None or finished == 1:
             return due_date
 
-        curr_time = datetime.now()
+        days_until_due = due_day - dates.today()
 
-        try:
-            due_date_time = datetime.strptime(due_date, '%m-%d-%Y')
-        except ValueError:
-            due_date_time = datetime.strptime(due_date, '%m/%d/%Y')
-
-        time_until_due = due_date_time - curr_time
-
-        SECONDS_IN_DAY = 86400
-
-        # Overdue tasks are colored red
-        if int(time_until_due.total_seconds()) < 0:
+        # Overdue tasks are colored red. A task is due at the start of its
+        # due date, so that includes tasks due today
+        if days_until_due <= 0:
             return self.color_message(due_date, 'RED', 'BOLD')
 
         # Tasks due in 24 hours or less are colored orange
-        if int(time_until_due.total_seconds()) < SECONDS_IN_DAY:
+        if days_until_due == 1:
             return self.color_message(due_date, 'ORANGE', 'BOLD')
 
         return due_date
 
-    def format_long_lines(self, long_text, element):
-        wrapper = textwrap.TextWrapper(width=self.max_col_widths[element])
-        return '\n'.join(wrapper.wrap(text=long_text))
+    def format_long_lines(self, long_text, element, width=None):
+        """ Wraps text to fit in a column, by the columns it takes up on
+            screen. Text that already fits, and that the wrapper wouldn't
+            change anyway (no tabs, newlines or trailing spaces), is returned
+            as is """
+        width = width or self.max_col_widths[element]
+        text_width = visible_width(long_text)
+        if text_width <= width and long_text.isprintable() and not long_text.endswith(' '):
+            return long_text
+        if text_width != len(long_text):
+            # textwrap counts a wide character as one column
+            return '\n'.join(wrap_wide(long_text, width))
+
+        if width not in self.wrappers:
+            import textwrap
+            self.wrappers[width] = textwrap.TextWrapper(width=width)
+        return '\n'.join(self.wrappers[width].wrap(text=long_text))
+
+    def task_table_layout(self, max_id, term_width):
+        """ Works out the width of each column of the task table before any
+            task is formatted, from max_col_widths, the widest ID that will be
+            shown and the terminal width. Long columns are narrowed to fit as
+            far as they can; the table may still be wider than the terminal """
+        widths = {}
+        for header in TASK_HEADERS:
+            cap = self.max_col_widths[header.rstrip('?')]
+            widths[header] = max(len(header), cap)
+        widths['ID'] = max(len('ID'), len(str(max_id)))
+
+        excess = TableWriter.table_width(widths.values()) - term_width
+        for index, header in enumerate(SHRINKABLE_COLUMNS):
+            # Share what has to go between the shrinkable columns left
+            share = -(-excess // (len(SHRINKABLE_COLUMNS) - index)) if excess > 0 else 0
+            narrowest = max(len(header), MIN_SHRINK_WIDTH)
+            new_width = max(narrowest, widths[header] - share)
+            excess -= widths[header] - new_width
+            widths[header] = new_width
+
+        return widths
+
+    def print_task_list(self, pages, max_id, show_heading=True):
+        """ Formats and prints tasks as a table, a page of tasks at a time.
+            `pages` is an iterable of task lists (see DB.iter_task_pages) and
+            `max_id` is the largest ID that could be shown. The layout is
+            fixed before anything is read, so a terminal that's too narrow is
+            caught straight away, and each page is written out as soon as it's
+            formatted. Returns the number of tasks shown, or None if the table
+            doesn't fit """
+        from itertools import chain
+        term_width = self.terminal_width()
+        widths = self.task_table_layout(max_id, term_width)
+        table_width = TableWriter.table_width(widths.values())
+        if table_width > term_width:
+            self.print_message(f'The task list has a width of {table_width} and cannot fit in the terminal of width {term_width}.')
+            return None
 
-    def print_task_list_formatted(self, rows):
-        """ Prints each formatted task to the terminal in the form
-            of a table """
-        header = [self.color_message(i, 'BOLD') for i in ['ID', 'Added', 'Title', 'Description', 'Due', 'Finished?']]
-        table_data = [task.values() for task in rows]
-        table_data.insert(0, header) # The column headers are the first element of the list
-        table = AsciiTable(table_data) # Create the table -- but test width before printing
-        table.inner_row_border = True # Separates each task
+        pages = iter(pages)
+        first_page = next(pages, None)
+        if not first_page:
+            return 0
 
-        if not self.check_table_fit(table):
-            max_width_table = table.table_width
-            term_width = shutil.get_terminal_size().columns
-            self.print_message(f'The task list has a width of {max_width_table} and cannot fit in the terminal of width {term_width}.')
+        if show_heading:
+            self.print_message('Here are your current tasks:')
+        sys.stdout.flush()
+
+        table = TableWriter(list(widths.values()), sys.stdout)
+        table.write_header([self.color_message(header, 'BOLD') for header in TASK_HEADERS])
+
+        for page in chain([first_page], pages):
+            for row in self.format_row(page, widths):
+                table.write_row(row)
+
+        table.close()
+        sys.stdout.flush()
+        return table.rows_written
+
+    def print_task_list_formatted(self, rows, show_heading=True):
+        """ Prints tasks that have already been through format_row as a
+            table, without narrowing any columns """
+        widths = self.task_table_layout(max((int(row.id) for row in rows), default=0), term_width=sys.maxsize)
+        table_width = TableWriter.table_width(widths.values())
+        term_width = self.terminal_width()
+
+        if table_width > term_width:
+            self.print_message(f'The task list has a width of {table_width} and cannot fit in the terminal of width {term_width}.')
             return
 
         # The table fits and we can print it
-        self.print_message('Here are your current tasks:')
-        print(table.table)
+        if show_heading:
+            self.print_message('Here are your current tasks:')
+        sys.stdout.flush()
+
+        table = TableWriter(list(widths.values()), sys.stdout)
+        table.write_header([self.color_message(header, 'BOLD') for header in TASK_HEADERS])
+        for row in rows:
+            table.write_row(row)
+        table.close()
+        sys.stdout.flush()
 
     # Methods for ADDING tasks
     def ask_user_title(self):
@@ -247,6 +434,17 @@ class Display:
                 self.print_error('That\'s not a valid date format!')
         return date
 
+    def ask_user_repeat(self):
+        """ Gets an optional way for the task to repeat from the user """
+        while True:
+            repeat = input(self.color_message('Optionally, make the task repeat (daily, weekly, monthly or every N days/weeks/months): ', 'BOLD'))
+            try:
+                dates.to_repeat(repeat)
+            except ValueError as err:
+                self.print_error(f'{err}!')
+                continue
+            return repeat
+
     def ask_user_finished(self):
         """ Asks a user if a task is finished """
         valid_responses = {
@@ -267,7 +465,12 @@ class Display:
                 return default_resp
             self.print_error('That\'s not a valid answer! Answer (y/N).')
 
-    def ask_user_id(self, action):
-        """ Ask the user for a task ID to remove/finish/unfinish/update """
-        row_id = input(self.color_message(f'What task would you like to {action}? (Enter an ID or `-1` to cancel): ', 'BOLD'))
+    def ask_user_id(self, action, many=False):
+        """ Ask the user for a task ID to remove/finish/unfinish/update, or
+            for several IDs (such as 3,7,10-40) if `many` is set """
+        if many:
+            prompt = f'What tasks would you like to {action}? (Enter IDs such as 3,7,10-40 or `-1` to cancel): '
+        else:
+            prompt = f'What task would you like to {action}? (Enter an ID or `-1` to cancel): '
+        row_id = input(self.color_message(prompt, 'BOLD'))
         return row_id
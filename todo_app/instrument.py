@@ -0,0 +1,211 @@
+""" Instrumentation for `python-todo --profile` (or $TODO_PROFILE).
+
+    Profiler.install wraps each stage of a command (opening the database,
+    reading, formatting, building and writing the table...) with a timer,
+    opens database connections through TimedConnection so every SQL
+    statement is timed, and counts statements with sqlite3's trace callback.
+    A breakdown is printed to stderr when the command is done, as text or
+    JSON. None of this is imported or installed unless profiling was asked
+    for, so it costs nothing otherwise.
+"""
+import sys
+import json
+import time
+import sqlite3
+import functools
+import contextlib
+
+# Statements listed in the text breakdown, slowest first
+REPORTED_STATEMENTS = 10
+
+def stage_targets():
+    """ Returns the (label, owner, method name) of every timed stage """
+    import argparse
+    from . import db, display, table, cache, client
+    return (
+        ('parse_args', argparse.ArgumentParser, 'parse_args'),
+        ('daemon', client.RemoteDB, 'call'),
+        ('db_open', db.DB, '__init__'),
+        ('clear_terminal', display.Display, 'clear_terminal'),
+        ('count_tasks', db.DB, 'get_num_tasks'),
+        ('count_tasks', db.DB, 'has_tasks'),
+        ('view_cache', cache, 'load'),
+        ('view_cache', cache, 'save'),
+        ('read_tasks', db.DB, 'get_tasks'),
+        ('read_tasks', db.DB, 'iter_task_pages'),
+        ('format_rows', display.Display, 'format_row'),
+        ('build_table', table.TableWriter, 'add_row'),
+        ('commit', db.DB, 'commit'),
+        ('archive', db.DB, 'archive_if_due')
+    )
+
+class TimedCursor(sqlite3.Cursor):
+    """ A cursor that reports how long each statement takes, including
+        fetching its rows, to TimedConnection.profiler """
+    sql = None
+
+    def execute(self, sql, *args):
+        self.sql = sql
+        return self.timed(super().execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        self.sql = sql
+        return self.timed(super().executemany, sql, *args)
+
+    def fetchone(self):
+        return self.timed(super().fetchone)
+
+    def fetchmany(self, *args):
+        return self.timed(super().fetchmany, *args)
+
+    def fetchall(self):
+        return self.timed(super().fetchall)
+
+    def timed(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            TimedConnection.profiler.add_statement_time(self.sql, time.perf_counter() - start)
+
+class TimedConnection(sqlite3.Connection):
+    """ A connection whose cursors are TimedCursors, and which counts every
+        statement SQLite runs (including inside triggers) """
+    profiler = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.set_trace_callback(self.profiler.count_statement)
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+class TimedStream:
+    """ Stands in for stdout, timing every write and flush """
+    def __init__(self, stream, profiler):
+        self.stream = stream
+        self.profiler = profiler
+
+    def write(self, text):
+        with self.profiler.stage('stdout'):
+            return self.stream.write(text)
+
+    def flush(self):
+        with self.profiler.stage('stdout'):
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+class Profiler:
+    """ Collects stage timings and statement counts for one command """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.statements = {}
+        self.traced = 0
+        self.active = set()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """ Times a block as part of the named stage. A stage entered again
+            from inside itself (such as a nested write) is only timed once """
+        if name in self.active:
+            yield
+            return
+
+        self.active.add(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.active.discard(name)
+            calls, seconds = self.stages.get(name, (0, 0.0))
+            self.stages[name] = (calls + 1, seconds + time.perf_counter() - start)
+
+    def timed(self, name, function):
+        """ Wraps a function (or generator function) so every call of it is
+            timed as part of the named stage """
+        profiler = self
+
+        def timed_generator(generator):
+            while True:
+                with profiler.stage(name):
+                    try:
+                        item = next(generator)
+                    except StopIteration:
+                        return
+                yield item
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with profiler.stage(name):
+                result = function(*args, **kwargs)
+            if hasattr(result, '__next__') and hasattr(result, 'gi_frame'):
+                return timed_generator(result)
+            return result
+        return wrapper
+
+    def install(self):
+        """ Starts profiling: wraps every stage, times every statement and
+            every write to stdout """
+        from . import db
+        for label, owner, name in stage_targets():
+            function = owner.__dict__[name]
+            if isinstance(function, staticmethod):
+                setattr(owner, name, staticmethod(self.timed(label, function.__func__)))
+            else:
+                setattr(owner, name, self.timed(label, function))
+
+        TimedConnection.profiler = self
+        db.DB.connection_factory = TimedConnection
+        sys.stdout = TimedStream(sys.stdout, self)
+
+    def count_statement(self, statement):
+        """ sqlite3 trace callback """
+        self.traced += 1
+
+    def add_statement_time(self, sql, seconds):
+        if sql is None:
+            return
+        sql = ' '.join(sql.split())
+        calls, total = self.statements.get(sql, (0, 0.0))
+        self.statements[sql] = (calls + 1, total + seconds)
+
+    def results(self):
+        """ Returns everything measured, as a dict ready for JSON """
+        stages = {name: {'calls': calls, 'ms': seconds * 1000} for name, (calls, seconds) in self.stages.items()}
+        statements = [{'sql': sql, 'calls': calls, 'ms': seconds * 1000}
+                      for sql, (calls, seconds) in sorted(self.statements.items(), key=lambda item: -item[1][1])]
+        return {
+            'total_ms': (time.perf_counter() - self.started) * 1000,
+            'stages': stages,
+            'statements_run': self.traced,
+            'statements': statements
+        }
+
+    def report(self, fmt, stream=None):
+        """ Prints the breakdown, to stderr unless another stream is given """
+        stream = stream or sys.stderr
+        results = self.results()
+        if fmt == 'json':
+            stream.write(json.dumps(results) + '\n')
+            return
+
+        lines = ['python-todo profile (ms)',
+                 f'  {"total":<16}{results["total_ms"]:10.2f}']
+        for name, stage in sorted(results['stages'].items(), key=lambda item: -item[1]['ms']):
+            lines.append(f'  {name:<16}{stage["ms"]:10.2f}  ({stage["calls"]} calls)')
+
+        sql_ms = sum(statement['ms'] for statement in results['statements'])
+        lines.append(f'SQL: {results["statements_run"]} statements run (counting triggers), {sql_ms:.2f} ms')
+        for statement in results['statements'][:REPORTED_STATEMENTS]:
+            sql = statement['sql'] if len(statement['sql']) <= 70 else statement['sql'][:67] + '...'
+            lines.append(f'  {statement["ms"]:8.2f} {statement["calls"]:6}x  {sql}')
+        stream.write('\n'.join(lines) + '\n')
+
+    def uninstall(self):
+        """ Puts stdout back. Wrapped stages stay wrapped, the process is about to end """
+        if isinstance(sys.stdout, TimedStream):
+            sys.stdout.flush()
+            sys.stdout = sys.stdout.stream
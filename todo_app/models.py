@@ -0,0 +1,38 @@
+from collections import namedtuple
+
+class Task:
+    """ A task as stored in the database, with its raw values: `added` is
+        seconds since the epoch, `due` is a day number (see dates.to_day) or
+        None and `finished` is 0 or 1. `repeat` is how often the task repeats
+        (see dates.to_repeat) or None; a repeating task is due on its next
+        occurrence. `position` is the ID shown to the user (its place in the
+        task list), filled in by the DB """
+    __slots__ = ('id', 'added', 'title', 'description', 'due', 'finished', 'repeat', 'position')
+
+    def __init__(self, id, added, title, description, due, finished, repeat=None, position=None):
+        self.id = id
+        self.added = added
+        self.title = title
+        self.description = description
+        self.due = due
+        self.finished = finished
+        self.repeat = repeat
+        self.position = position
+
+    def __repr__(self):
+        return (f'Task(id={self.id!r}, added={self.added!r}, title={self.title!r}, description={self.description!r}, '
+                f'due={self.due!r}, finished={self.finished!r}, repeat={self.repeat!r}, position={self.position!r})')
+
+    def __eq__(self, other):
+        if not isinstance(other, Task):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in Task.__slots__)
+
+    @staticmethod
+    def from_row(cursor, row):
+        """ sqlite3 row factory for queries selecting db.TASK_COLUMNS """
+        return Task(*row)
+
+# A task ready to be shown: every column formatted as a string, in the
+# order of the task table's columns
+FormattedRow = namedtuple('FormattedRow', ('id', 'added', 'title', 'description', 'due', 'finished'))
@@ -0,0 +1,134 @@
+""" A long-lived python-todo daemon.
+
+    Holds the database connection open (with its page cache and prepared
+    statements) and keeps recently rendered task tables, so commands sent by
+    client.RemoteDB skip interpreter startup, imports and opening the
+    database. See client.py for the protocol.
+"""
+import io
+import os
+import json
+import time
+import signal
+import contextlib
+import socketserver
+from . import db
+from . import views
+from . import client
+from .display import Display
+from .models import Task
+
+# Seconds a client gets to send its request (and read the response).
+# Requests are handled one at a time, so a stuck client holds up the rest
+REQUEST_TIMEOUT = 5
+
+# Rendered task tables kept, the least recently used being dropped first
+MAX_VIEWS = 32
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """ Answers a single JSON request """
+    timeout = REQUEST_TIMEOUT
+
+    def handle(self):
+        try:
+            line = self.rfile.readline()
+        except OSError:
+            return # Timed out or went away without sending a request
+        try:
+            request = json.loads(line)
+            result = self.server.dispatch(request['command'], request.get('args', []), request.get('kwargs', {}))
+            response = {'ok': True, 'result': result}
+        except Exception as err: # Reported to the client rather than stopping the daemon
+            response = {'ok': False, 'error': f'{type(err).__name__}: {err}'}
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+class TodoServer(socketserver.UnixStreamServer):
+    """ Serves one task list over a Unix socket. Requests are handled one at
+        a time on a single connection to the database """
+    def __init__(self, db_file=None):
+        self.db_link = db.DB(db_file)
+        self.path = client.socket_path(self.db_link.db_file)
+        self.views = {}
+        self.data_version = self.db_link.get_data_version()
+
+        if client.served_file(self.path) is not None:
+            raise OSError(f'A daemon is already listening on {self.path}')
+        if os.path.exists(self.path):
+            os.unlink(self.path) # Left behind by a daemon that didn't shut down cleanly
+
+        # Only the user running the daemon may connect to it
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(self.path, RequestHandler)
+        finally:
+            os.umask(old_umask)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def dispatch(self, command, args, kwargs):
+        """ Carries out a request, returning its result """
+        if command == 'ping':
+            # Lets clients check it's the task list they asked for
+            return os.path.realpath(self.db_link.db_file)
+        if command == 'view':
+            return self.render_view(**kwargs)
+        if command not in client.REMOTE_METHODS:
+            raise ValueError(f'Unknown command {command!r}')
+
+        try:
+            result = getattr(self.db_link, command)(*args, **kwargs)
+        except Exception:
+            # Never keep the write lock (or a half done write) after a
+            # request fails, whatever the method left behind
+            if self.db_link.db_connection.in_transaction:
+                self.db_link.db_connection.rollback()
+            raise
+        if command in client.WRITE_METHODS:
+            self.views.clear()
+        if isinstance(result, Task):
+            return [getattr(result, name) for name in Task.__slots__]
+        return result
+
+    def render_view(self, width=None, **options):
+        """ Returns the task table as views.print_tasks prints it, reusing a
+            recent rendering if the task list hasn't changed since """
+        data_version = self.db_link.get_data_version()
+        if data_version != self.data_version:
+            # Another process wrote to the task list
+            self.data_version = data_version
+            self.views.clear()
+
+        # Kept until the 'Added' column or a due date's color would change
+        key = json.dumps([width, options], sort_keys=True)
+        view = self.views.pop(key, None)
+        if view is not None and time.time() < view[0]:
+            self.views[key] = view # Now the most recently used
+            return view[1]
+
+        output = io.StringIO()
+        view_display = Display(term_width=width)
+        with contextlib.redirect_stdout(output):
+            views.print_tasks(self.db_link, view_display, **options)
+        if len(self.views) >= MAX_VIEWS:
+            del self.views[next(iter(self.views))]
+        self.views[key] = (view_display.valid_until, output.getvalue())
+        return self.views[key][1]
+
+def serve(db_file=None):
+    """ Runs a daemon for the task list until it's interrupted or terminated """
+    server = TodoServer(db_file)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    print(f'Serving {server.db_link.db_file} on {server.path}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
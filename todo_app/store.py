@@ -0,0 +1,404 @@
+""" The python-todo library API.
+
+    TodoStore gives other programs the task list without any of the
+    command line's prompting or printing:
+
+        from todo_app import TodoStore
+
+        with TodoStore('~/work.db') as store:
+            task_id = store.add('Write report', due='12/01/2026')
+            store.finish(task_id)
+            for task in store.tasks(status='open'):
+                print(task.position, task.title)
+
+    AsyncTodoStore has the same methods as coroutines, for use from asyncio.
+    Every read returns models.Task records; every write of many tasks
+    happens in a single transaction.
+"""
+import functools
+from . import db
+from . import dates
+
+# Picks every task (that matches any filters) in place of a list of IDs
+ALL_IDS = 'all'
+
+def parse_ids(text):
+    """ Parses a list of the IDs shown next to tasks, such as '3,7,10-40'.
+        Returns it as (first, last) ranges (see to_ranges), or None for
+        'all'. Ranges are never expanded, so any size is quick. Raises
+        ValueError if the list can't be understood """
+    if text.strip().lower() == ALL_IDS:
+        return None
+
+    ranges = []
+    for part in text.split(','):
+        first, dash, last = part.strip().partition('-')
+        try:
+            first = int(first)
+            last = int(last) if dash else first
+        except ValueError:
+            raise ValueError(f'{part.strip()!r} is not an ID or a range of IDs (such as 10-40)') from None
+        if first < 1 or last < first:
+            raise ValueError(f'{part.strip()!r} is not an ID or a range of IDs (such as 10-40)')
+        ranges.append((first, last))
+    return to_ranges(ranges)
+
+def to_ranges(ids):
+    """ Turns shown IDs and (first, last) ranges of them, in any order, into
+        the fewest ranges covering the same IDs, sorted and not overlapping """
+    ranges = []
+    for first, last in sorted(item if isinstance(item, (tuple, list)) else (item, item) for item in ids):
+        if ranges and first <= ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], last))
+        else:
+            ranges.append((first, last))
+    return ranges
+
+class TodoStore:
+    """ A task list for use from Python. Not safe to share between threads;
+        use AsyncTodoStore (or one TodoStore per thread) for that.
+
+        `backend` may be given instead of a database file: anything with the
+        methods of db.DB that are used, such as a client.RemoteDB """
+    def __init__(self, db_file=None, profile='default', backend=None):
+        self.db = backend if backend is not None else db.DB(db_file, profile)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """ Closes the database connection """
+        if isinstance(self.db, db.DB):
+            self.db.db_connection.close()
+
+    # Reading
+
+    def tasks(self, **filters):
+        """ Returns every task (matching the filters of DB.task_filter) """
+        return self.db.get_tasks(**filters)
+
+    def pages(self, limit, page=1, **filters):
+        """ Yields lists of at most `limit` tasks, starting at the given page """
+        return self.db.iter_task_pages(limit, page, **filters)
+
+    def get(self, task_id):
+        """ Returns the task with the given stable ID, or None """
+        return self.db.get_task(task_id)
+
+    def count(self):
+        """ Returns the number of tasks """
+        return self.db.get_num_tasks()
+
+    def stats(self):
+        """ Returns a dict of how many tasks there are: total, open,
+            finished, overdue, due_today and archived (see DB.get_stats) """
+        return self.db.get_stats()
+
+    def resolve_many(self, ids, **filters):
+        """ Returns the stable IDs of the tasks picked by `ids`: shown IDs
+            and ranges such as '3,7,10-40', a list of shown IDs or of
+            (first, last) ranges such as parse_ids returns, or 'all'. Only
+            tasks matching the filters of DB.task_filter are picked
+            (`archived=True` picks from the archive). Without filters every
+            ID must be shown, or ValueError is raised """
+        ranges = parse_ids(ids) if isinstance(ids, str) else to_ranges(ids)
+        if ranges is not None:
+            # Nothing past the last task is shown, so ranges stop there
+            num_tasks = self.db.get_num_tasks(archived=bool(filters.get('archived')))
+            # Picking from the archive doesn't narrow anything down
+            narrowed = any(value is not None for name, value in filters.items() if name != 'archived')
+            past = next((first for first, last in ranges if last > num_tasks), None)
+            if past is not None and not narrowed:
+                raise ValueError(f'No task is shown with ID {max(past, num_tasks + 1)}')
+            ranges = [(first, min(last, num_tasks)) for first, last in ranges if first <= num_tasks]
+
+        return [task_id for position, task_id in self.db.resolve_ids(ranges, **filters)]
+
+    def is_empty(self):
+        """ Returns True if there are no tasks, without counting them all """
+        return not self.db.has_tasks()
+
+    def resolve(self, position):
+        """ Returns the stable ID of the task shown with the given ID, or None """
+        return self.db.resolve_id(position)
+
+    # Writing. Tasks are picked by their stable ID (Task.id)
+
+    def add(self, title, description='', due=None, finished=False, repeat=None):
+        """ Adds a task and returns its stable ID. The due date may be typed
+            by a user ('mm/dd/yyyy'), a date or a day number. `repeat` makes
+            the task repeat: 'daily', 'weekly', 'monthly' or 'every N
+            days/weeks/months' """
+        return self.db.add_task(title, description, due, int(finished), repeat)
+
+    def add_many(self, tasks):
+        """ Adds (title, description, due, finished) tuples, returning how
+            many were added """
+        return self.db.add_tasks(tasks)
+
+    def update(self, task_id, **changes):
+        """ Changes some of a task's title, description, due, finished and
+            repeat. Returns the task as saved (with its due date and repeat
+            rule converted), or None if there's no such task """
+        for name in changes:
+            if name not in ('title', 'description', 'due', 'finished', 'repeat'):
+                raise TypeError(f'update() got an unexpected keyword argument {name!r}')
+
+        task = self.get(task_id)
+        if task is None:
+            return None
+        for name, value in changes.items():
+            setattr(task, name, value)
+        if 'due' in changes and 'repeat' not in changes and task.repeat is not None:
+            # A repeating task moved to another day counts from there
+            task.repeat = dates.without_anchor(task.repeat)
+        task.finished = int(task.finished)
+        self.update_many([task])
+        return self.get(task_id)
+
+    def update_many(self, tasks):
+        """ Saves changes made to Task records, returning how many were found """
+        return self.db.update_tasks([(task.id, task.title, task.description, task.due, int(task.finished), task.repeat)
+                                     for task in tasks])
+
+    def finish(self, *task_ids):
+        """ Finishes tasks, returning how many weren't finished already. A
+            repeating task stays open, due on its next occurrence, and the
+            occurrence finished is added as a finished task """
+        return self.db.finish_tasks(task_ids)
+
+    def unfinish(self, *task_ids):
+        """ Unfinishes tasks, returning how many were finished """
+        return self.db.unfinish_tasks(task_ids)
+
+    def remove(self, *task_ids):
+        """ Removes tasks, returning how many were removed """
+        return self.db.remove_tasks(task_ids)
+
+    def compact(self):
+        """ Shrinks the database file after many tasks have been removed """
+        self.db.compact()
+
+    # Archiving. Archived tasks are read with the `archived=True` filter
+
+    def archive(self, days):
+        """ Moves tasks finished at least `days` days ago to the archive,
+            returning how many were moved """
+        return self.db.archive_tasks(days)
+
+    def archive_if_due(self, days=None):
+        """ Archives tasks finished at least `days` days ago (by default
+            db.archive_days()) if that hasn't been done in the last day.
+            Returns how many were archived """
+        return self.db.archive_if_due(db.archive_days() if days is None else days)
+
+    def restore(self, *archive_ids):
+        """ Moves archived tasks (picked by their Task.id in the archive)
+            back to the task list, returning how many were restored """
+        return self.db.restore_tasks(archive_ids)
+
+    # Moving whole task lists. Neither needs more memory for a bigger list
+
+    def export_tasks(self, stream, fmt='jsonl'):
+        """ Writes every task to a text stream as JSONL, CSV or TSV (see
+            transfer.write_tasks). Returns how many tasks were written """
+        from . import transfer
+        return transfer.write_tasks(self.db.iter_task_rows(transfer.CHUNK_SIZE), stream, fmt)
+
+    def import_tasks(self, stream, fmt='jsonl', resume_key=None, progress=None):
+        """ Adds the tasks in a JSONL, CSV or TSV text stream, such as one
+            written by export_tasks, committing them a chunk at a time.
+            Raises transfer.TaskFileError at the first chunk with a problem.
+            Given a resume_key (such as the file's path), an import that
+            stopped part way carries on after the tasks it already added.
+            `progress` is called with the running total after each chunk.
+            Returns how many tasks were added by this call """
+        from . import transfer
+        skip = self.import_progress(resume_key)
+        imported = skip
+        chunks = transfer.read_task_chunks(stream, fmt, skip=skip)
+        for imported in self.db.import_tasks(chunks, self.progress_key(resume_key), skip):
+            if progress is not None:
+                progress(imported)
+        return imported - skip
+
+    def sync_export(self, stream, since=0):
+        """ Writes every change logged after sequence number `since` to a
+            text stream, for sync_apply on another copy of the task list.
+            The work done depends on the number of changes, not the size of
+            the task list. Returns how many changes were written and the
+            sequence number to export from next time """
+        from . import transfer
+        written, last_seq = transfer.write_changes(self.db.iter_change_log(since, transfer.SYNC_CHUNK_SIZE), stream)
+        return written, since if last_seq is None else last_seq
+
+    def sync_apply(self, stream):
+        """ Applies the changes in a stream written by sync_export, a chunk
+            per transaction (see DB.apply_changes for how conflicts are
+            settled). Applying the same changes twice does nothing. Raises
+            transfer.TaskFileError at the first chunk with a problem. Returns
+            how many changes were read and how many were applied """
+        from . import transfer
+        read = applied = 0
+        for chunk in transfer.read_change_chunks(stream):
+            applied += self.db.apply_changes(chunk)
+            read += len(chunk)
+        return read, applied
+
+    def import_progress(self, resume_key):
+        """ Returns how many tasks an unfinished import_tasks with the same
+            resume_key has added """
+        if resume_key is None:
+            return 0
+        return self.db.get_meta(self.progress_key(resume_key), 0)
+
+    @staticmethod
+    def progress_key(resume_key):
+        """ Returns the meta table key an import's progress is kept under """
+        return None if resume_key is None else f'import:{resume_key}'
+
+class AsyncTodoStore:
+    """ TodoStore for asyncio. Any number of coroutines may use one store at
+        once: the database work is queued on a thread of its own, so the
+        event loop never waits on SQLite.
+
+            async with AsyncTodoStore() as store:
+                task_id = await store.add('Write report')
+                async for tasks in store.pages(100):
+                    ...
+    """
+    def __init__(self, db_file=None, profile='default'):
+        from concurrent.futures import ThreadPoolExecutor
+
+        # SQLite connections belong to the thread that opened them, so the
+        # store is opened on the executor's one thread too
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='todo-store')
+        self.opening = self.executor.submit(TodoStore, db_file, profile)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def run(self, method, *args, **kwargs):
+        """ Calls a TodoStore method on the store's thread """
+        return await self.run_on_thread(functools.partial(self.call, method, *args, **kwargs))
+
+    async def run_on_thread(self, function, *args):
+        """ Calls any function on the store's thread """
+        # Imported here since anyone awaiting this has imported it already
+        import asyncio
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    def call(self, method, *args, **kwargs):
+        # Runs on the store's thread, after the store was opened
+        return getattr(self.opening.result(), method)(*args, **kwargs)
+
+    async def close(self):
+        """ Closes the database connection and stops the store's thread """
+        try:
+            await self.run('close')
+        finally:
+            self.executor.shutdown(wait=False)
+
+    async def tasks(self, **filters):
+        """ See TodoStore.tasks """
+        return await self.run('tasks', **filters)
+
+    async def pages(self, limit, page=1, **filters):
+        """ See TodoStore.pages. Each page is read when it's asked for """
+        pages = await self.run('pages', limit, page, **filters)
+        while True:
+            tasks = await self.run_on_thread(next, pages, None)
+            if tasks is None:
+                return
+            yield tasks
+
+    async def get(self, task_id):
+        """ See TodoStore.get """
+        return await self.run('get', task_id)
+
+    async def count(self):
+        """ See TodoStore.count """
+        return await self.run('count')
+
+    async def stats(self):
+        """ See TodoStore.stats """
+        return await self.run('stats')
+
+    async def resolve_many(self, ids, **filters):
+        """ See TodoStore.resolve_many """
+        return await self.run('resolve_many', ids, **filters)
+
+    async def is_empty(self):
+        """ See TodoStore.is_empty """
+        return await self.run('is_empty')
+
+    async def resolve(self, position):
+        """ See TodoStore.resolve """
+        return await self.run('resolve', position)
+
+    async def add(self, title, description='', due=None, finished=False, repeat=None):
+        """ See TodoStore.add """
+        return await self.run('add', title, description, due, finished, repeat)
+
+    async def add_many(self, tasks):
+        """ See TodoStore.add_many """
+        return await self.run('add_many', list(tasks))
+
+    async def update(self, task_id, **changes):
+        """ See TodoStore.update """
+        return await self.run('update', task_id, **changes)
+
+    async def update_many(self, tasks):
+        """ See TodoStore.update_many """
+        return await self.run('update_many', list(tasks))
+
+    async def finish(self, *task_ids):
+        """ See TodoStore.finish """
+        return await self.run('finish', *task_ids)
+
+    async def unfinish(self, *task_ids):
+        """ See TodoStore.unfinish """
+        return await self.run('unfinish', *task_ids)
+
+    async def remove(self, *task_ids):
+        """ See TodoStore.remove """
+        return await self.run('remove', *task_ids)
+
+    async def archive(self, days):
+        """ See TodoStore.archive """
+        return await self.run('archive', days)
+
+    async def archive_if_due(self, days=None):
+        """ See TodoStore.archive_if_due """
+        return await self.run('archive_if_due', days)
+
+    async def restore(self, *archive_ids):
+        """ See TodoStore.restore """
+        return await self.run('restore', *archive_ids)
+
+    async def export_tasks(self, stream, fmt='jsonl'):
+        """ See TodoStore.export_tasks. The stream is written from the store's thread """
+        return await self.run('export_tasks', stream, fmt)
+
+    async def import_tasks(self, stream, fmt='jsonl', resume_key=None, progress=None):
+        """ See TodoStore.import_tasks. The stream is read, and `progress`
+            called, from the store's thread """
+        return await self.run('import_tasks', stream, fmt, resume_key, progress)
+
+    async def sync_export(self, stream, since=0):
+        """ See TodoStore.sync_export. The stream is written from the store's thread """
+        return await self.run('sync_export', stream, since)
+
+    async def sync_apply(self, stream):
+        """ See TodoStore.sync_apply. The stream is read from the store's thread """
+        return await self.run('sync_apply', stream)
+
+    async def compact(self):
+        """ See TodoStore.compact """
+        return await self.run('compact')
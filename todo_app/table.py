@@ -0,0 +1,119 @@
+import re
+import unicodedata
+
+# Color codes take up no space on screen
+ANSI_ESCAPE = re.compile('\033\\[[0-9;]*m')
+
+# Rows buffered before they're written out
+ROWS_PER_WRITE = 64
+
+def visible_width(text):
+    """ Returns how many terminal columns a line of text takes up """
+    if '\033' in text:
+        text = ANSI_ESCAPE.sub('', text)
+    if text.isascii():
+        return len(text)
+    return sum(2 if unicodedata.east_asian_width(char) in 'WF' else 1 for char in text)
+
+def wrap_wide(text, width):
+    """ Wraps text to lines no more than `width` columns wide on screen,
+        like textwrap with its defaults but counting wide characters (see
+        visible_width) as two columns. Words too wide for a line of their
+        own are broken wherever they reach the end of one. Returns the lines """
+    lines = []
+    line = ''
+    used = 0
+    for word in text.expandtabs().split():
+        word_width = visible_width(word)
+        if line and used + 1 + word_width <= width:
+            line += ' ' + word
+            used += 1 + word_width
+            continue
+        if word_width <= width:
+            if line:
+                lines.append(line)
+            line, used = word, word_width
+            continue
+
+        # Start a word that has to be broken on the current line if a bit of
+        # it fits there
+        if line and used + 2 < width:
+            line += ' '
+            used += 1
+        for char in word:
+            char_width = visible_width(char)
+            if line and used + char_width > width:
+                lines.append(line)
+                line, used = '', 0
+            line += char
+            used += char_width
+    if line:
+        lines.append(line)
+    return lines
+
+class TableWriter:
+    """ Writes a table that looks like a terminaltables AsciiTable with inner
+        row borders, one row at a time. Column widths are fixed up front, so
+        nothing has to be measured or kept around once a row is written """
+    def __init__(self, widths, stream):
+        self.widths = widths
+        self.stream = stream
+        self.border = '+' + '+'.join('-' * (width + 2) for width in widths) + '+\n'
+        self.buffer = []
+        self.rows_written = 0
+
+    @staticmethod
+    def table_width(widths):
+        """ Returns the width of a table with the given column widths """
+        return sum(widths) + 3 * len(widths) + 1
+
+    def write_header(self, cells):
+        """ Writes the top border and the column headers """
+        self.buffer.append(self.border)
+        self.add_row(cells)
+
+    def write_row(self, cells):
+        """ Writes one row. Cells may span several lines """
+        self.buffer.append(self.border)
+        self.add_row(cells)
+        self.rows_written += 1
+        if self.rows_written % ROWS_PER_WRITE == 0:
+            self.flush()
+
+    def close(self):
+        """ Writes the bottom border and anything still buffered """
+        self.buffer.append(self.border)
+        self.flush()
+
+    def flush(self):
+        """ Writes out the buffered lines in one go """
+        self.stream.write(''.join(self.buffer))
+        self.buffer = []
+
+    def add_row(self, cells):
+        """ Buffers the lines of a row """
+        self.buffer.extend(line + '\n' for line in self.row_lines(cells))
+
+    @staticmethod
+    def cell_lines(text, width):
+        """ Splits a cell into its lines, wrapping any that are wider than
+            the column on screen """
+        lines = text.split('\n')
+        if all(visible_width(line) <= width for line in lines):
+            return lines
+        return [part for line in lines for part in (wrap_wide(line, width) or [''])]
+
+    def row_lines(self, cells):
+        """ Lays a row's cells out side by side, padding each line of each
+            cell to its column's width. Returns the lines, without newlines """
+        cell_lines = [self.cell_lines(str(cell), width) for cell, width in zip(cells, self.widths)]
+        height = max(len(lines) for lines in cell_lines)
+
+        row_lines = []
+        for line_num in range(height):
+            parts = []
+            for lines, width in zip(cell_lines, self.widths):
+                line = lines[line_num] if line_num < len(lines) else ''
+                parts.append(line + ' ' * (width - visible_width(line)))
+            row_lines.append('| ' + ' | '.join(parts) + ' |')
+        return row_lines
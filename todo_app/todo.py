@@ -1,47 +1,214 @@
-import argparse
+import os
+import sys
+import time
 from . import display
 from . import db
+from . import dates
+from . import views
+from . import client
+from . import store
+
+# argparse and the transfer module are imported only when they're needed,
+# see QuickArgs
+
+# Arguments that change how a command behaves rather than picking one
+OPTION_ARGS = ('db', 'format', 'page', 'limit', 'follow', 'status', 'due_before', 'due_after', 'search', 'archived', 'profile')
+
+# Arguments that narrow the task list down, both for showing it and for
+# picking the tasks to remove/finish/unfinish/restore
+FILTER_ARGS = ('status', 'due_before', 'due_after', 'search', 'archived')
+
+# Commands after which old finished tasks may need archiving
+ARCHIVING_ARGS = ('add', 'finish', 'change', 'bulk', 'import_file')
+
+# Arguments that change which tasks are shown
+VIEW_ARGS = ('page', 'limit', 'follow') + FILTER_ARGS
+
+# Environment variable that turns on --profile ('1'/'text' or 'json')
+PROFILE_ENV = 'TODO_PROFILE'
+
+# Formats the --profile breakdown can be printed in
+PROFILE_FORMATS = ('text', 'json')
+
+# Formats --stats can print the task counts in
+STATS_FORMATS = ('text', 'json')
+
+# Bytes buffered before they're written out by --export
+EXPORT_BUFFER_SIZE = 1024 * 1024
+
+# Command lines simple enough to skip argparse for, and the arguments they
+# give. These are what shell prompts and status bars run over and over
+QUICK_ARGS = {
+    (): {},
+    ('-v',): {'view': True},
+    ('--view',): {'view': True},
+    ('--stats',): {'stats': 'text'}
+}
+
+class QuickArgs:
+    """ Stands in for parsed arguments when the command line is in QUICK_ARGS.
+        Every argument it wasn't given reads as not given """
+    def __init__(self, **given):
+        vars(self).update(given)
+
+    def __getattr__(self, name):
+        return None
 
 class Todo:
     def __init__(self):
         self.display = display.Display()
-        self.db_link = db.DB()
 
         # Set up arguments
-        self.arg_parser = self.setup_args()
-        args = self.arg_parser.parse_args()
+        if tuple(sys.argv[1:]) in QUICK_ARGS:
+            args = QuickArgs(**QUICK_ARGS[tuple(sys.argv[1:])])
+        else:
+            self.arg_parser = self.setup_args()
+            args = self.arg_parser.parse_args()
+        self.args = args
 
-        # Always print a welcome
-        self.display.print_welcome()
+        if args.daemon:
+            from . import server
+            server.serve(args.db)
+            return
 
-        # Check for arguments
-        if self.check_args(args):
-            self.handle_args(args)
-        else:
-            # No args given. Show tasks if there are any, or commands
-            if self.db_link.get_num_tasks() == 0:
-                self.display.print_commands()
+        # Go through the daemon if one is serving the task list
+        self.store = store.TodoStore(args.db, backend=client.connect(db.resolve_db_file(args.db)))
+
+        # Always print a welcome, unless tasks (or changes) are being
+        # exported to stdout or counted for a prompt
+        if args.export != '-' and not args.sync_export and not args.stats:
+            self.display.print_welcome()
+
+        try:
+            # Check for arguments
+            if self.check_args(args):
+                self.handle_args(args)
             else:
-                self.print_tasks()
+                # No args given. Show tasks if there are any, or commands
+                if self.store.is_empty() and not args.archived:
+                    self.display.print_commands()
+                else:
+                    self.print_tasks()
+        except client.DaemonError as err:
+            self.display.print_error(str(err))
+            sys.exit(1)
 
     def setup_args(self):
         """ Creates an argument parser and adds the allowed arguments """
+        import argparse
+        from . import transfer
+
         self.parser = argparse.ArgumentParser()
         self.group = self.parser.add_mutually_exclusive_group()
 
         self.group.add_argument('-a', '--add', help='Adds a new task to the task list', action='store_true')
-        self.group.add_argument('-r', '--remove', help='Removes a task from the task list', action='store_true')
-        self.group.add_argument('-f', '--finish', help='Sets a task to be finished', action='store_true')
-        self.group.add_argument('-u', '--unfinish', help='Sets a task to be not finished', action='store_true')
+        ids_help = ' (IDS such as 3,7,10-40, or `all`; asks when omitted)'
+        self.group.add_argument('-r', '--remove', help='Removes tasks from the task list' + ids_help, metavar='IDS', nargs='?', const=True, type=self.id_list)
+        self.group.add_argument('-f', '--finish', help='Sets tasks to be finished' + ids_help, metavar='IDS', nargs='?', const=True, type=self.id_list)
+        self.group.add_argument('-u', '--unfinish', help='Sets tasks to be not finished' + ids_help, metavar='IDS', nargs='?', const=True, type=self.id_list)
         self.group.add_argument('-c', '--change', help='Updates an existing task', action='store_true')
         self.group.add_argument('-v', '--view', help='View your current task list', action='store_true')
+        self.group.add_argument('--agenda', help=f'Shows what\'s due in the next DAYS days (default {views.DEFAULT_AGENDA_DAYS}), '
+                                'repeating tasks once for each time they\'re due', metavar='DAYS', nargs='?', const=True, type=self.days)
+        self.group.add_argument('--watch', help='Keeps the task list (or the tasks matching the filters) on screen, redrawn as it changes', action='store_true')
+        self.group.add_argument('--stats', help='Prints how many tasks are open, overdue, due today, finished and archived on one line (or as json)',
+                                metavar='FORMAT', nargs='?', const='text', choices=STATS_FORMATS)
+        self.group.add_argument('--compact', help='Reclaims space left behind by removed tasks', action='store_true')
+        self.group.add_argument('--archive', help='Archives tasks finished at least DAYS days ago (default $TODO_ARCHIVE_DAYS or '
+                                f'{db.DEFAULT_ARCHIVE_DAYS}). This also happens by itself once a day',
+                                metavar='DAYS', nargs='?', const=True, type=self.days)
+        self.group.add_argument('--restore', help='Moves archived tasks (IDS as shown by --archived) back to the task list',
+                                metavar='IDS', type=self.id_list)
+        self.group.add_argument('--daemon', help='Serves the task list to other python-todo commands until stopped', action='store_true')
+        self.group.add_argument('--bulk', help='Adds every task in FILE (JSONL/CSV/TSV) without prompting. Reads stdin when FILE is omitted or `-`',
+                                metavar='FILE', nargs='?', const='-')
+        self.group.add_argument('--export', help='Writes every task to FILE (JSONL/CSV/TSV, JSONL unless FILE ends in .csv/.tsv). Writes to stdout when FILE is omitted or `-`',
+                                metavar='FILE', nargs='?', const='-')
+        self.group.add_argument('--import', help='Adds every task in FILE written by --export, a chunk at a time. Run it again to carry on after an interruption',
+                                metavar='FILE', dest='import_file')
+        self.group.add_argument('--sync-export', help='Writes the changes made since change number SINCE to stdout, for --sync-apply on another copy of the task list (0 for every change)',
+                                metavar='SINCE', type=self.sequence)
+        self.group.add_argument('--sync-apply', help='Applies changes written by --sync-export on another copy of the task list. Reads stdin when FILE is `-`',
+                                metavar='FILE')
+        self.parser.add_argument('--db', help=f'Uses the task list stored in FILE instead of ~/.todo.db (or ${db.DB_FILE_ENV})', metavar='FILE')
+        self.parser.add_argument('--format', help='Format of the --bulk, --import or --export file. Guessed from the file when omitted', choices=transfer.FORMATS)
+        self.parser.add_argument('--page', help='Shows only page N of the task list', metavar='N', type=self.positive_int)
+        self.parser.add_argument('--limit', help=f'Number of tasks per page (default {views.DEFAULT_PAGE_SIZE})', metavar='N', type=self.positive_int)
+        self.parser.add_argument('--follow', help='Keeps printing the pages after --page until the end of the task list', action='store_true')
+        self.parser.add_argument('--status', help='Shows only open or finished tasks', choices=db.STATUSES)
+        self.parser.add_argument('--due-before', help='Shows only tasks due before DATE', metavar='DATE', type=self.due_date)
+        self.parser.add_argument('--due-after', help='Shows only tasks due after DATE', metavar='DATE', type=self.due_date)
+        self.parser.add_argument('--search', help='Shows only tasks with TEXT in their title or description', metavar='TEXT')
+        self.parser.add_argument('--profile', help=f'Prints how long each stage and SQL statement took to stderr (also ${PROFILE_ENV})',
+                                 nargs='?', const='text', choices=PROFILE_FORMATS)
+        self.parser.add_argument('--archived', help='Shows archived tasks instead of the task list', action='store_true', default=None)
 
         return self.parser
 
+    @staticmethod
+    def positive_int(value):
+        """ Argument type for page numbers and sizes """
+        import argparse
+        try:
+            number = int(value)
+        except ValueError:
+            number = 0
+        if number < 1:
+            raise argparse.ArgumentTypeError(f'{value!r} is not a positive number')
+        return number
+
+    @staticmethod
+    def due_date(value):
+        """ Argument type for due date filters. Returns the date as a day number """
+        import argparse
+        try:
+            return dates.to_day(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'{value!r} is not a valid date (\'mm/dd/yyyy\' or \'mm-dd-yyyy\')')
+
+    @staticmethod
+    def id_list(value):
+        """ Argument type for the IDs given to remove/finish/unfinish/restore.
+            Parsed once here into ranges (see store.parse_ids); 'all' is kept
+            as text, so it still counts as given """
+        import argparse
+        try:
+            ranges = store.parse_ids(value)
+        except ValueError as err:
+            raise argparse.ArgumentTypeError(str(err))
+        return store.ALL_IDS if ranges is None else ranges
+
+    @staticmethod
+    def days(value):
+        """ Argument type for --archive. Kept as text, so 0 still counts as given """
+        import argparse
+        if not value.isdigit():
+            raise argparse.ArgumentTypeError(f'{value!r} is not a number of days')
+        return value
+
+    @staticmethod
+    def sequence(value):
+        """ Argument type for --sync-export. Kept as text, so 0 still counts as given """
+        import argparse
+        if not value.isdigit():
+            raise argparse.ArgumentTypeError(f'{value!r} is not a change number')
+        return value
+
+    def get_filters(self):
+        """ Returns the filters given on the command line, for DB.task_filter """
+        return {arg: getattr(self.args, arg) for arg in FILTER_ARGS if getattr(self.args, arg) is not None}
+
+    def get_view_options(self):
+        """ Returns the paging options and filters given on the command line,
+            for views.print_tasks """
+        return {arg: getattr(self.args, arg) for arg in VIEW_ARGS if getattr(self.args, arg) is not None}
+
     @staticmethod
     def check_args(args):
         """ Returns True if an argument was given False otherwise. Used in setup """
         for arg in vars(args):
+            if arg in OPTION_ARGS:
+                continue
             if getattr(args, arg):
                 return True
         return False
@@ -51,117 +218,423 @@ class Todo:
         if args.add:
             self.add_task()
             self.print_tasks()
+        # The task list is shown first when the user has to pick from it
         if args.remove:
-            self.print_tasks()
-            self.remove_task()
+            if args.remove is True:
+                self.print_tasks()
+            self.remove_task(args.remove)
         if args.finish:
-            self.print_tasks()
-            self.finish_task()
+            if args.finish is True:
+                self.print_tasks()
+            self.finish_task(args.finish)
         if args.unfinish:
-            self.print_tasks()
-            self.unfinish_task()
+            if args.unfinish is True:
+                self.print_tasks()
+            self.unfinish_task(args.unfinish)
         if args.change:
             self.print_tasks()
             self.update_task()
         if args.view:
             self.view_tasks()
+        if args.agenda:
+            self.print_agenda(args.agenda)
+        if args.watch:
+            self.watch_tasks()
+        if args.stats:
+            self.print_stats(args.stats)
+        if args.compact:
+            self.compact()
+        if args.bulk:
+            self.bulk_add_tasks(args.bulk, args.format)
+        if args.export:
+            self.export_tasks(args.export, args.format)
+        if args.import_file:
+            self.import_tasks(args.import_file, args.format)
+        if args.sync_export:
+            self.sync_export(int(args.sync_export))
+        if args.sync_apply:
+            self.sync_apply(args.sync_apply)
+        if args.archive:
+            self.archive_tasks(args.archive)
+        if args.restore:
+            self.restore_tasks(args.restore)
+
+        if any(getattr(args, arg) for arg in ARCHIVING_ARGS):
+            self.archive_if_due()
 
     def add_task(self):
         """ Adds a task to the task list """
         task_title = self.display.ask_user_title()
         task_description = self.display.ask_user_description()
         task_due = self.display.ask_user_due()
+        task_repeat = self.display.ask_user_repeat()
 
         # Call the db function to add data
-        self.db_link.add_task(task_title, task_description, task_due)
+        self.store.add(task_title, task_description, task_due, repeat=task_repeat)
         self.display.print_success('\nTask successfully added.\n')
 
-    def remove_task(self):
-        """ Removes a task from the task list """
-        row_id = self.get_valid_id('remove') # Get the task ID user wants removed
+    def bulk_add_tasks(self, file_name, file_format):
+        """ Adds every task found in a file (or stdin) in one go """
+        from . import transfer
 
-        if row_id == -1:
+        try:
+            stream = sys.stdin if file_name == '-' else open(file_name, encoding='utf-8', newline='')
+        except OSError as err:
+            self.display.print_error(f'Couldn\'t open {file_name}: {err.strerror}')
             return
 
-        self.db_link.remove_task(row_id) # Actually remove the task
+        with stream:
+            if file_format is None:
+                # Peek at the first line to work out the format
+                first_line = stream.readline()
+                file_format = transfer.guess_format(file_name, first_line)
+                lines = transfer.chain_first_line(first_line, stream)
+            else:
+                lines = stream
+
+            start = time.perf_counter()
+            try:
+                tasks = transfer.read_tasks(lines, file_format)
+            except transfer.TaskFileError as err:
+                self.display.print_error(f'No tasks were added:\n{err}')
+                return
+            self.store.add_many(tasks)
+            elapsed = time.perf_counter() - start
+
+        rate = len(tasks) / elapsed if elapsed > 0 else len(tasks)
+        self.display.print_success(f'{len(tasks)} tasks successfully added in {elapsed:.2f}s ({rate:,.0f} tasks/s).')
+
+    def local_store(self):
+        """ Returns a store that uses the database directly, for moving whole
+            task lists (which can't be streamed through the daemon) """
+        if isinstance(self.store.db, client.RemoteDB):
+            return store.TodoStore(self.args.db)
+        return self.store
+
+    def export_tasks(self, file_name, file_format):
+        """ Writes every task to a file (or stdout) """
+        from . import transfer
+
+        file_format = file_format or transfer.format_from_name(file_name) or 'jsonl'
+        try:
+            stream = sys.stdout if file_name == '-' else open(file_name, 'w', encoding='utf-8', newline='', buffering=EXPORT_BUFFER_SIZE)
+        except OSError as err:
+            self.display.print_error(f'Couldn\'t open {file_name}: {err.strerror}')
+            return
+
+        start = time.perf_counter()
+        with stream:
+            exported = self.local_store().export_tasks(stream, file_format)
+        elapsed = time.perf_counter() - start
+
+        if file_name != '-':
+            rate = exported / elapsed if elapsed > 0 else exported
+            self.display.print_success(f'{exported} tasks exported to {file_name} in {elapsed:.2f}s ({rate:,.0f} tasks/s).')
+
+    def import_tasks(self, file_name, file_format):
+        """ Adds every task in a file (or stdin) written by --export, carrying
+            on from where an earlier import of the same file stopped """
+        from . import transfer
+
+        try:
+            stream = sys.stdin if file_name == '-' else open(file_name, encoding='utf-8', newline='')
+        except OSError as err:
+            self.display.print_error(f'Couldn\'t open {file_name}: {err.strerror}')
+            return
+
+        # Only files can be read again to carry on
+        resume_key = None if file_name == '-' else os.path.abspath(file_name)
+        task_store = self.local_store()
+        skip = task_store.import_progress(resume_key)
+        if skip:
+            self.display.print_message(f'Carrying on after the {skip} tasks already imported from {file_name}.')
+
+        done = 0
+
+        def progress(imported):
+            nonlocal done
+            done = imported - skip
+            if sys.stdout.isatty():
+                sys.stdout.write(f'\r{imported:,} tasks imported...')
+                sys.stdout.flush()
+
+        with stream:
+            if file_format is None:
+                first_line = stream.readline()
+                file_format = transfer.guess_format(file_name, first_line)
+                lines = transfer.chain_first_line(first_line, stream)
+            else:
+                lines = stream
+
+            start = time.perf_counter()
+            try:
+                imported = task_store.import_tasks(lines, file_format, resume_key, progress)
+            except transfer.TaskFileError as err:
+                self.display.print_error(f'\nThe import stopped after adding {done} tasks:\n{err}')
+                if resume_key is not None:
+                    self.display.print_message('Fix the file and run the same command to carry on.')
+                return
+            elapsed = time.perf_counter() - start
+
+        rate = imported / elapsed if elapsed > 0 else imported
+        self.display.print_success(f'\n{imported} tasks successfully imported in {elapsed:.2f}s ({rate:,.0f} tasks/s).')
+
+    def sync_export(self, since):
+        """ Writes the changes made since a change number to stdout """
+        written, last_seq = self.local_store().sync_export(sys.stdout, since)
+        sys.stdout.flush()
+        sys.stderr.write(f'{written} changes exported. Next time, use `--sync-export {last_seq}`.\n')
+
+    def sync_apply(self, file_name):
+        """ Applies changes exported from another copy of the task list """
+        from . import transfer
+
+        try:
+            stream = sys.stdin if file_name == '-' else open(file_name, encoding='utf-8')
+        except OSError as err:
+            self.display.print_error(f'Couldn\'t open {file_name}: {err.strerror}')
+            return
+
+        with stream:
+            try:
+                read, applied = self.local_store().sync_apply(stream)
+            except transfer.TaskFileError as err:
+                self.display.print_error(f'The sync stopped part way, run it again once the file is fixed:\n{err}')
+                return
+        self.display.print_success(f'{applied} of {read} changes applied. The rest were already here or were overtaken by later changes.')
+
+    def remove_task(self, ids=True):
+        """ Removes tasks from the task list, given their IDs or asking for them """
+        task_ids = self.get_valid_ids('remove', ids) # Get the task IDs user wants removed
+
+        if not task_ids:
+            return
+
+        self.store.remove(*task_ids) # Actually remove the tasks
 
         # If the task list is empty, print that fact, else print the rest of the tasks
-        if self.db_link.get_num_tasks() > 0:
-            self.display.print_success('\nTask successfully removed.\n')
+        if not self.store.is_empty():
+            self.display.print_success(f'\n{self.tasks_changed(task_ids, "removed")}\n')
             self.print_tasks()
         else:
-            self.display.print_success('\nTask successfully removed. Your task list is empty.')
+            self.display.print_success(f'\n{self.tasks_changed(task_ids, "removed")} Your task list is empty.')
 
-    def finish_task(self):
-        """ Finishes a given task in the task list """
-        row_id = self.get_valid_id('finish')
+    def finish_task(self, ids=True):
+        """ Finishes tasks in the task list, given their IDs or asking for them """
+        task_ids = self.get_valid_ids('finish', ids)
 
-        if row_id == -1:
+        if not task_ids:
             return
 
-        self.db_link.finish_task(row_id)
-        self.display.print_success('\nTask successfully finished.\n')
+        self.store.finish(*task_ids)
+        self.display.print_success(f'\n{self.tasks_changed(task_ids, "finished")}\n')
         self.print_tasks()
 
-    def unfinish_task(self):
-        """" Unfinishes a given task in the task list """
-        row_id = self.get_valid_id('unfinish')
+    def unfinish_task(self, ids=True):
+        """" Unfinishes tasks in the task list, given their IDs or asking for them """
+        task_ids = self.get_valid_ids('unfinish', ids)
 
-        if row_id == -1:
+        if not task_ids:
             return
 
-        self.db_link.unfinish_task(row_id)
-        self.display.print_success('\nTask successfully unfinished.\n')
+        self.store.unfinish(*task_ids)
+        self.display.print_success(f'\n{self.tasks_changed(task_ids, "unfinished")}\n')
         self.print_tasks()
 
+    @staticmethod
+    def tasks_changed(task_ids, action):
+        """ Returns a message saying how many tasks were changed """
+        if len(task_ids) == 1:
+            return f'Task successfully {action}.'
+        return f'{len(task_ids)} tasks successfully {action}.'
+
     def update_task(self):
         """ Updates a given task in the task list """
-        row_id = self.get_valid_id('update')
+        task_id = self.get_valid_id('update')
 
-        if row_id == -1:
+        if task_id == -1:
             return
 
         task_title = self.display.ask_user_title()
         task_description = self.display.ask_user_description()
         task_due = self.display.ask_user_due()
+        task_repeat = self.display.ask_user_repeat()
         task_finished = self.display.ask_user_finished()
 
         # Call the db function to update data
-        self.db_link.update_task(row_id, task_title, task_description, task_due, task_finished)
+        self.store.update(task_id, title=task_title, description=task_description, due=task_due, repeat=task_repeat,
+                          finished=task_finished)
         self.display.print_success('\nTask successfully updated.\n')
         self.print_tasks()
 
     def view_tasks(self):
         """ Prints the current task list or a message if there are no tasks """
-        if self.db_link.get_num_tasks() > 0:
+        if self.args.archived or not self.store.is_empty():
             self.print_tasks()
         else:
             self.display.print_error('You don\'t have any tasks! Add a task by calling `python-todo -a`.')
 
+    def print_agenda(self, days):
+        """ Prints what's due in the next few days """
+        days = views.DEFAULT_AGENDA_DAYS if days is True else int(days)
+        if days < 1:
+            self.display.print_error('--agenda needs at least 1 day to show.')
+            return
+        views.print_agenda(self.local_store().db, self.display, days)
+
+    def watch_tasks(self):
+        """ Keeps the task list on screen, redrawing what changes, until
+            the user presses Ctrl+C """
+        from . import watch
+
+        if not sys.stdout.isatty():
+            self.display.print_error('--watch needs a terminal to draw the task list in.')
+            return
+        if self.args.archived:
+            self.display.print_error('--watch can\'t show the archive, it only changes once a day.')
+            return
+
+        filters = self.get_filters()
+        watch.Watcher(self.local_store().db, self.display, **filters).run()
+
+    def print_stats(self, fmt):
+        """ Prints the task counts, which take no longer to get for a longer
+            task list """
+        stats = self.store.stats()
+        if fmt == 'json':
+            import json
+            print(json.dumps(stats))
+        else:
+            print(self.display.format_stats(stats))
+
+    def archive_tasks(self, days):
+        """ Archives tasks finished at least `days` days ago, or the configured
+            number of days """
+        if days is True:
+            days = db.archive_days()
+            if days is None:
+                days = db.DEFAULT_ARCHIVE_DAYS
+        archived = self.store.archive(int(days))
+        self.display.print_success(f'{archived} tasks finished at least {days} days ago were archived.')
+
+    def archive_if_due(self):
+        """ Archives old finished tasks if that hasn't been done today """
+        archived = self.store.archive_if_due(db.archive_days())
+        if archived:
+            self.display.print_message(f'{archived} old finished tasks were archived. See them with `python-todo --archived`.')
+
+    def restore_tasks(self, ids):
+        """ Moves archived tasks back to the task list """
+        filters = dict(self.get_filters(), archived=True)
+        try:
+            archive_ids = self.store.resolve_many(ids, **filters)
+        except ValueError as err:
+            self.display.print_error(f'{err}. No tasks were changed.')
+            return
+        if not archive_ids:
+            self.display.print_error('No archived tasks match the given filters.')
+            return
+
+        self.store.restore(*archive_ids)
+        self.display.print_success(f'\n{self.tasks_changed(archive_ids, "restored")}\n')
+        self.args.archived = None # Show the task list they went back to
+        self.print_tasks()
+
+    def compact(self):
+        """ Shrinks the database file after many tasks have been removed """
+        self.store.compact()
+        self.display.print_success('Task list successfully compacted.')
+
     def get_valid_id(self, action):
-        """ Gets a valid row ID from the user, used for remove/finish/unfinish
-            and updating rows"""
+        """ Gets a valid task ID from the user, used for remove/finish/unfinish
+            and updating rows. The ID the user sees is resolved to the task's
+            stable ID """
         row_id = self.display.ask_user_id(action)
+        task_id = self.store.resolve(row_id)
 
         # We repeat until we get a valid ID or user cancels
-        while not self.db_link.verify_id(row_id):
+        while task_id is None:
             # User cancelled operation
             if row_id == '-1':
                 return -1
 
-            if not self.db_link.verify_id(row_id):
-                self.display.print_error('Invalid ID given.')
+            self.display.print_error('Invalid ID given.')
 
             row_id = self.display.ask_user_id(action)
+            task_id = self.store.resolve(row_id)
+
+        return task_id
+
+    def get_valid_ids(self, action, ids=True):
+        """ Gets the stable IDs of the tasks to remove/finish/unfinish, from
+            the IDS given on the command line or else from the user. Only
+            tasks matching the command line's filters are picked. Returns an
+            empty list if there are none or the user cancels """
+        filters = self.get_filters()
+        filters.pop('archived', None) # Archived tasks can only be restored
+
+        if ids is not True:
+            try:
+                task_ids = self.store.resolve_many(ids, **filters)
+            except ValueError as err:
+                self.display.print_error(f'{err}. No tasks were changed.')
+                return []
+            if not task_ids:
+                self.display.print_error('No tasks match the given filters.')
+            return task_ids
+
+        # We repeat until we get valid IDs or user cancels
+        while True:
+            row_ids = self.display.ask_user_id(action, many=True)
 
-        return row_id
+            # User cancelled operation
+            if row_ids.strip() == '-1':
+                return []
+
+            try:
+                task_ids = self.store.resolve_many(row_ids, **filters)
+            except ValueError:
+                task_ids = []
+            if task_ids:
+                return task_ids
+
+            self.display.print_error('Invalid ID given.')
 
     def print_tasks(self):
         """ Obtains each row of the task list and prints them after formatting """
-        unformatted_rows = self.db_link.get_tasks()
-        formatted_rows = self.display.format_row(unformatted_rows)
-        self.display.print_task_list_formatted(formatted_rows)
+        if isinstance(self.store.db, client.RemoteDB):
+            self.store.db.print_tasks(self.display, **self.get_view_options())
+        else:
+            views.print_cached_tasks(self.store.db, self.display, **self.get_view_options())
+
+def profile_format(argv):
+    """ Returns the format --profile or $TODO_PROFILE asks for a breakdown
+        in, or None when profiling is off. Checked before arguments are
+        parsed, so parsing can be timed too """
+    for index, arg in enumerate(argv):
+        if arg == '--profile':
+            following = argv[index + 1] if index + 1 < len(argv) else None
+            return following if following in PROFILE_FORMATS else 'text'
+        if arg.startswith('--profile='):
+            return arg.split('=', 1)[1]
+
+    setting = os.environ.get(PROFILE_ENV, '').strip().lower()
+    if setting in ('', '0', 'no', 'off'):
+        return None
+    return 'json' if setting == 'json' else 'text'
 
 def run():
     """ Entry point: creates or loads a new task list if one exists """
-    Todo()
+    fmt = profile_format(sys.argv[1:])
+    if fmt is None:
+        Todo()
+        return
+
+    from . import instrument
+    profiler = instrument.Profiler()
+    profiler.install()
+    try:
+        Todo()
+    finally:
+        profiler.uninstall()
+        profiler.report(fmt)
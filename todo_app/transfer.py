@@ -0,0 +1,309 @@
+import csv
+import json
+import time
+import itertools
+from . import dates
+
+# Columns understood when reading tasks from a file, in CSV/TSV order
+FIELDS = ('title', 'description', 'due', 'finished')
+
+# Columns written by --export. `added` is in seconds since the epoch, so
+# tasks keep their age when they're imported again, and `repeat` is how
+# often a task repeats (see dates.to_repeat)
+EXPORT_FIELDS = FIELDS + ('added', 'repeat')
+
+# Tasks read, written or committed at a time by --export and --import
+CHUNK_SIZE = 10000
+
+FORMATS = ('jsonl', 'csv', 'tsv')
+
+# Kinds of change in a --sync-export file (see db.CHANGE_TRIGGERS)
+CHANGE_OPS = ('add', 'update', 'finish', 'unfinish', 'remove', 'archive', 'restore')
+
+# Changes applied at a time by --sync-apply, each batch in one transaction
+SYNC_CHUNK_SIZE = 1000
+
+# Remembers due dates that failed to parse
+INVALID_DATE = object()
+
+# Stop listing problems with a file after this many
+MAX_REPORTED_ERRORS = 10
+
+class TaskFileError(Exception):
+    """ Raised when tasks read from a file can't be added to the task list """
+
+def format_from_name(name):
+    """ Returns the file format matching a file's extension, or None """
+    for fmt in FORMATS:
+        if name.endswith('.' + fmt):
+            return fmt
+    return None
+
+def guess_format(name, first_line):
+    """ Picks a file format from the file's extension, falling back to
+        sniffing the first line (used for stdin) """
+    if format_from_name(name):
+        return format_from_name(name)
+    if first_line.lstrip().startswith('{'):
+        return 'jsonl'
+    if '\t' in first_line:
+        return 'tsv'
+    return 'csv'
+
+def chain_first_line(first_line, stream):
+    """ Puts a line read by guess_format back in front of the stream """
+    return itertools.chain([first_line], stream)
+
+def read_records(stream, fmt):
+    """ Yields (line number, record dict) pairs from a JSONL, CSV or TSV stream.
+        CSV and TSV files may start with a header row naming the columns """
+    if fmt == 'jsonl':
+        for line_num, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as err:
+                raise TaskFileError(f'Line {line_num}: {err}')
+            if not isinstance(record, dict):
+                raise TaskFileError(f'Line {line_num}: expected a JSON object')
+            yield line_num, record
+        return
+
+    reader = csv.reader(stream, delimiter='\t' if fmt == 'tsv' else ',')
+    columns = FIELDS
+    for row in reader:
+        if not row:
+            continue
+        if reader.line_num == 1 and row[0].strip().lower() == 'title':
+            columns = tuple(column.strip().lower() for column in row)
+            continue
+        yield reader.line_num, dict(zip(columns, row))
+
+def to_row(record, line_num):
+    """ Turns a record into a (title, description, due, finished) tuple.
+        The due date is still the text from the file at this point """
+    title = str(record.get('title') or '').strip()
+    if title == '':
+        raise TaskFileError(f'Line {line_num}: the title can\'t be an empty string')
+
+    finished = record.get('finished') or 0
+    if isinstance(finished, str):
+        finished = finished.strip().lower() in ('1', 'y', 'yes', 'true', 'x', '✓')
+
+    return (title,
+            str(record.get('description') or ''),
+            str(record.get('due') or '').strip(),
+            1 if finished else 0)
+
+def to_added(record, line_num, now):
+    """ Returns when a record's task was added, in seconds since the epoch.
+        Tasks without an `added` column are added `now` """
+    added = record.get('added')
+    if added is None or added == '':
+        return now
+    try:
+        return int(added)
+    except ValueError:
+        raise TaskFileError(f'Line {line_num}: {added!r} is not a number of seconds since the epoch')
+
+def to_repeat(record, line_num):
+    """ Returns how often a record's task repeats, as stored in the database """
+    try:
+        return dates.to_repeat(str(record.get('repeat') or ''))
+    except ValueError as err:
+        raise TaskFileError(f'Line {line_num}: {err}')
+
+def iter_rows(stream, fmt, with_added=False):
+    """ Yields (line number, row, error) for each record in a stream, where
+        row is a (title, description, due, finished) tuple with the due date
+        as a day number, or (added, title, description, due, finished,
+        repeat) when `with_added` is set. Invalid records come with an error message
+        instead of a row. Due dates are parsed once per distinct value,
+        since generated task lists tend to reuse a handful of dates """
+    parsed_dates = {'': None}
+    now = int(time.time())
+
+    for line_num, record in read_records(stream, fmt):
+        try:
+            row = to_row(record, line_num)
+            added = to_added(record, line_num, now) if with_added else None
+            repeat = to_repeat(record, line_num) if with_added else None
+        except TaskFileError as err:
+            yield line_num, None, str(err)
+            continue
+
+        due = row[2]
+        if due not in parsed_dates:
+            try:
+                parsed_dates[due] = dates.to_day(due)
+            except ValueError:
+                parsed_dates[due] = INVALID_DATE
+        if parsed_dates[due] is INVALID_DATE:
+            yield line_num, None, f'Line {line_num}: {due!r} is not a valid due date'
+            continue
+
+        row = row[:2] + (parsed_dates[due],) + row[3:]
+        yield line_num, (added,) + row + (repeat,) if with_added else row, None
+
+def report_errors(errors):
+    """ Raises a TaskFileError listing the first few problems found """
+    reported = errors[:MAX_REPORTED_ERRORS]
+    if len(errors) > MAX_REPORTED_ERRORS:
+        reported.append(f'...and {len(errors) - MAX_REPORTED_ERRORS} more')
+    raise TaskFileError('\n'.join(reported))
+
+def read_tasks(stream, fmt):
+    """ Reads every task in a stream, validating each of them before anything
+        is written """
+    rows = []
+    errors = []
+
+    for line_num, row, error in iter_rows(stream, fmt):
+        if error is None:
+            rows.append(row)
+        else:
+            errors.append(error)
+
+    if errors:
+        report_errors(errors)
+
+    return rows
+
+def read_task_chunks(stream, fmt, chunk_size=CHUNK_SIZE, skip=0):
+    """ Yields lists of up to chunk_size (added, title, description, due,
+        finished, repeat) rows read from a stream, for DB.import_tasks. The first
+        `skip` tasks are passed over (they were imported by an earlier run).
+        Only one chunk is held in memory, so a chunk with problems stops
+        the import with a TaskFileError once the chunks before it are in """
+    chunk = []
+    errors = []
+
+    for line_num, row, error in iter_rows(stream, fmt, with_added=True):
+        if error is not None:
+            errors.append(error)
+        elif skip > 0:
+            skip -= 1
+        elif not errors:
+            chunk.append(row)
+
+        if len(chunk) == chunk_size or len(errors) > MAX_REPORTED_ERRORS:
+            if errors:
+                report_errors(errors)
+            yield chunk
+            chunk = []
+
+    if errors:
+        report_errors(errors)
+    if chunk:
+        yield chunk
+
+def write_tasks(chunks, stream, fmt):
+    """ Writes chunks of (added, title, description, due, finished, repeat)
+        rows (see DB.iter_task_rows) to a stream as JSONL, CSV or TSV, one chunk
+        per write. CSV and TSV files start with a header row. Returns how
+        many tasks were written """
+    formatted_dates = {None: ''}
+    written = 0
+
+    def records(chunk):
+        for added, title, description, due, finished, repeat in chunk:
+            if due not in formatted_dates:
+                formatted_dates[due] = dates.format_day(due)
+            yield title, description, formatted_dates[due], finished, added, repeat
+
+    if fmt == 'jsonl':
+        for chunk in chunks:
+            stream.write(''.join(json.dumps(dict(zip(EXPORT_FIELDS, record)), ensure_ascii=False) + '\n'
+                                 for record in records(chunk)))
+            written += len(chunk)
+        return written
+
+    writer = csv.writer(stream, delimiter='\t' if fmt == 'tsv' else ',', lineterminator='\n')
+    writer.writerow(EXPORT_FIELDS)
+    for chunk in chunks:
+        writer.writerows(records(chunk))
+        written += len(chunk)
+    return written
+
+def write_changes(chunks, stream):
+    """ Writes chunks of (seq, uid, op, payload, ts, origin) rows (see
+        DB.iter_change_log) to a stream as JSONL, one change per line.
+        Returns how many changes were written and the last seq written """
+    written = 0
+    last_seq = None
+    for chunk in chunks:
+        stream.write(''.join(json.dumps({'seq': seq, 'uid': uid, 'op': op, 'payload': None if payload is None else json.loads(payload),
+                                         'ts': ts, 'origin': origin}, ensure_ascii=False) + '\n'
+                             for seq, uid, op, payload, ts, origin in chunk))
+        written += len(chunk)
+        last_seq = chunk[-1][0]
+    return written, last_seq
+
+def to_change(record, line_num):
+    """ Turns a record written by write_changes into a (uid, op, payload,
+        ts, origin) tuple for DB.apply_changes. Raises TaskFileError if it
+        isn't one """
+    uid, op, payload, ts, origin = (record.get(name) for name in ('uid', 'op', 'payload', 'ts', 'origin'))
+    if not isinstance(uid, str) or not isinstance(origin, str) or not uid or not origin:
+        raise TaskFileError(f'Line {line_num}: a change needs a uid and an origin')
+    if op not in CHANGE_OPS:
+        raise TaskFileError(f'Line {line_num}: {op!r} is not a change ({", ".join(CHANGE_OPS)})')
+    if isinstance(ts, bool) or not isinstance(ts, (int, float)):
+        raise TaskFileError(f'Line {line_num}: a change needs a ts in seconds since the epoch')
+    if op == 'remove':
+        payload = None
+    elif not isinstance(payload, dict):
+        raise TaskFileError(f'Line {line_num}: a {op} change needs a payload object')
+    else:
+        check_payload(payload, line_num)
+    return uid, op, payload, ts, origin
+
+def check_payload(payload, line_num):
+    """ Raises TaskFileError if a field of a change's payload holds
+        something that can't be stored in the task list """
+    for name, value in payload.items():
+        if name in ('title', 'description'):
+            valid = isinstance(value, str)
+        elif name in ('finished', 'archived'):
+            valid = value in (0, 1) and not isinstance(value, bool)
+        elif name == 'date':
+            valid = isinstance(value, int) and not isinstance(value, bool)
+        elif name == 'due':
+            valid = value is None or (isinstance(value, int) and not isinstance(value, bool) and valid_day(value))
+        elif name == 'repeat':
+            valid = value is None or (isinstance(value, str) and valid_repeat(value))
+        else:
+            continue
+        if not valid:
+            raise TaskFileError(f'Line {line_num}: {value!r} is not a valid {name}')
+
+def valid_day(day):
+    """ Returns True if a day number is one a date can be worked out for """
+    try:
+        dates.from_day(day)
+    except (ValueError, OverflowError):
+        return False
+    return True
+
+def valid_repeat(rule):
+    """ Returns True if a repeat rule is one dates.to_repeat understands """
+    try:
+        dates.to_repeat(rule)
+    except ValueError:
+        return False
+    return True
+
+def read_change_chunks(stream, chunk_size=SYNC_CHUNK_SIZE):
+    """ Yields lists of up to chunk_size changes read from a stream written
+        by write_changes. A chunk is only yielded once every change in it
+        has been read, so a bad line stops the sync with a TaskFileError
+        after the chunks before it """
+    chunk = []
+    for line_num, record in read_records(stream, 'jsonl'):
+        chunk.append(to_change(record, line_num))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
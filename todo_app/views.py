@@ -0,0 +1,97 @@
+import sys
+import itertools
+import contextlib
+from . import cache
+from . import dates
+from .models import Task
+
+# Tasks shown per page when only --page or --follow is given
+DEFAULT_PAGE_SIZE = 50
+
+# Tasks read, formatted and written at a time when showing the whole list
+TABLE_CHUNK_SIZE = 500
+
+# Days covered by --agenda when it's given no number
+DEFAULT_AGENDA_DAYS = 7
+
+def print_tasks(db_link, display, page=None, limit=None, follow=False, **filters):
+    """ Prints the task list, or a page of it, as a table. Accepts the same
+        keyword filters as DB.task_filter. Rows are streamed from the
+        database a chunk (or page) at a time """
+    max_id = db_link.get_num_tasks(archived=filters.get('archived', False))
+
+    if page is None and limit is None and not follow:
+        pages = db_link.iter_task_pages(TABLE_CHUNK_SIZE, **filters)
+        if display.print_task_list(pages, max_id) == 0:
+            display.print_error('No tasks match the given filters.')
+        return
+
+    page = page or 1
+    limit = limit or DEFAULT_PAGE_SIZE
+    pages = db_link.iter_task_pages(limit, page, **filters)
+    if not follow:
+        pages = itertools.islice(pages, 1)
+
+    shown = display.print_task_list(pages, max_id)
+    if shown == 0:
+        display.print_error(f'There are no tasks on page {page}.')
+    elif shown == limit and not follow:
+        if any(value is not None for name, value in filters.items() if name != 'archived'):
+            # Tasks are counted among the matches, not by the IDs shown
+            display.print_message(f'Showing {shown} matching tasks (page {page}). Use `--page {page + 1}` to see more.')
+        else:
+            first = (page - 1) * limit + 1
+            display.print_message(f'Showing tasks {first}-{first + shown - 1}. Use `--page {page + 1}` to see more.')
+
+def agenda_tasks(db_link, days):
+    """ Returns the open tasks due in the `days` days from today, and the
+        ones overdue, by due date. A repeating task is listed once for each
+        of its occurrences in that time, but only those are worked out """
+    today = dates.today()
+    last_day = today + days - 1
+    agenda = []
+
+    for task in db_link.get_tasks(status='open', due_before=last_day + 1):
+        if task.repeat is None:
+            agenda.append(task)
+            continue
+        # Occurrences before the due date have been finished already
+        days_due = dates.occurrences(task.due, task.repeat, start=max(today, task.due))
+        if task.due < today:
+            # Occurrences missed since aren't listed again
+            days_due = itertools.chain([task.due], days_due)
+        for day in itertools.takewhile(lambda day: day <= last_day, days_due):
+            agenda.append(Task(task.id, task.added, task.title, task.description, day, task.finished, task.repeat, task.position))
+
+    agenda.sort(key=lambda task: (task.due, task.id))
+    return agenda
+
+def print_agenda(db_link, display, days):
+    """ Prints what's due in the next `days` days (see agenda_tasks) as a
+        table, keeping the IDs shown in the task list """
+    agenda = agenda_tasks(db_link, days)
+    if not agenda:
+        display.print_message(f'Nothing is due in the next {days} days.')
+        return
+
+    display.print_message(f'Due in the next {days} days:')
+    display.print_task_list([agenda], db_link.get_num_tasks(), show_heading=False)
+
+def print_cached_tasks(db_link, display, **options):
+    """ Prints the task list like print_tasks, reusing the output of the last
+        identical view when the task list hasn't changed since and the
+        output is still accurate. Takes one query when nothing has changed """
+    path = cache.cache_path(db_link.db_file)
+    key = cache.make_key(db_link.get_revision(), display.terminal_width(), options)
+
+    output = cache.load(path, key)
+    if output is not None:
+        sys.stdout.write(output)
+        sys.stdout.flush()
+        return
+
+    recorder = cache.Recorder(sys.stdout)
+    with contextlib.redirect_stdout(recorder):
+        print_tasks(db_link, display, **options)
+    if recorder.complete:
+        cache.save(path, key, recorder.getvalue(), display.valid_until)
@@ -0,0 +1,211 @@
+""" `python-todo --watch`: keeps the task list on screen, redrawn as it changes.
+
+    Changes are noticed by polling `PRAGMA data_version`, which only moves
+    when another connection commits, so an idle task list costs one pragma
+    per poll. Every task carries the revision it was last changed in (its
+    `rev`, see db.REV_TRIGGERS), so a refresh reads only the tasks changed
+    since the last one. Removed tasks show up as the task count falling
+    short of the IDs already known, and only then are the IDs read again.
+
+    What's on screen is kept as a list of lines. Each refresh lays the table
+    out again from rows formatted earlier (only changed or renumbered rows
+    are formatted again) and rewrites just the lines that differ, in place,
+    with cursor addressing ANSI codes.
+"""
+import os
+import sys
+import math
+import time
+import heapq
+from bisect import bisect_left, bisect_right
+from .table import TableWriter
+from .display import TASK_HEADERS
+
+# Seconds between checks for changes
+WATCH_INTERVAL = 0.5
+
+# Switches to the terminal's alternate screen and hides the cursor, and back
+ENTER_SCREEN = '\033[?1049h\033[?25l'
+LEAVE_SCREEN = '\033[?25h\033[?1049l'
+
+# Clear the whole screen, the rest of a line, or everything below the cursor
+CLEAR_SCREEN = '\033[2J'
+CLEAR_LINE = '\033[K'
+CLEAR_BELOW = '\033[J'
+
+def move_to(line):
+    """ Returns the ANSI code moving the cursor to the start of a line,
+        counted from 0 at the top of the screen """
+    return f'\033[{line + 1};1H'
+
+def terminal_size():
+    """ Returns the (columns, lines) of the terminal """
+    try:
+        size = os.get_terminal_size(sys.__stdout__.fileno())
+        return size.columns or 80, size.lines or 24
+    except (AttributeError, ValueError, OSError):
+        return 80, 24
+
+class Watcher:
+    """ Shows the tasks matching the filters of DB.task_filter on the
+        terminal's alternate screen until interrupted. Needs a db.DB, since
+        it polls the database itself """
+    def __init__(self, db_link, display, **filters):
+        self.db_link = db_link
+        self.display = display
+        self.filters = filters
+
+        self.data_version = None
+        self.revision = -1 # Every task has changed since before revision 0
+        self.stats = None
+
+        # Every task's ID in order, to number the tasks shown
+        self.ids = []
+        # Tasks matching the filters, by ID, and their IDs in order
+        self.tasks = {}
+        self.shown = []
+        # Lines of each row formatted so far, by ID, with the row's position
+        self.rows = {}
+
+        self.size = None
+        self.widths = None
+        self.screen = []
+
+    def run(self):
+        """ Refreshes the screen every WATCH_INTERVAL seconds until Ctrl+C """
+        sys.stdout.write(ENTER_SCREEN)
+        try:
+            while True:
+                self.refresh()
+                time.sleep(WATCH_INTERVAL)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sys.stdout.write(LEAVE_SCREEN)
+            sys.stdout.flush()
+
+    def refresh(self):
+        """ Reads any changes and redraws whatever they changed on screen """
+        data_version = self.db_link.get_data_version()
+        changed = data_version != self.data_version
+        self.data_version = data_version
+        if changed:
+            self.read_changes()
+
+        size = terminal_size()
+        if size != self.size:
+            # Nothing on screen can be trusted after a resize
+            self.size = size
+            self.screen = []
+            self.rows = {}
+            sys.stdout.write(CLEAR_SCREEN)
+        elif time.time() >= self.display.valid_until:
+            # Ages in the 'Added' column, or due date colors, have moved on
+            self.rows = {}
+        elif not changed:
+            return
+
+        if not self.rows:
+            self.display.valid_until = math.inf
+        self.stats = self.db_link.get_stats()
+        self.draw(self.render())
+
+    def read_changes(self):
+        """ Brings the tasks kept in memory up to date with the database """
+        revision, count, changed_ids, tasks = self.db_link.get_changes(self.revision, **self.filters)
+        if revision == self.revision:
+            return
+
+        new_ids = [task_id for task_id in changed_ids if not self.has_id(task_id)]
+        if new_ids:
+            self.ids = list(heapq.merge(self.ids, new_ids))
+
+        # Changed tasks that no longer match the filters drop out
+        for task_id in changed_ids:
+            self.tasks.pop(task_id, None)
+            self.rows.pop(task_id, None)
+        for task in tasks:
+            self.tasks[task.id] = task
+
+        if count != len(self.ids):
+            # Tasks were removed
+            self.ids = self.db_link.get_task_ids()
+            for task_id in [task_id for task_id in self.tasks if not self.has_id(task_id)]:
+                del self.tasks[task_id]
+                self.rows.pop(task_id, None)
+
+        self.shown = sorted(self.tasks)
+        self.revision = revision
+
+    def has_id(self, task_id):
+        """ Returns True if task_id is one of self.ids """
+        index = bisect_left(self.ids, task_id)
+        return index < len(self.ids) and self.ids[index] == task_id
+
+    def render(self):
+        """ Returns the lines that should be on screen, the table cut short
+            to fit the terminal's height """
+        term_width, term_height = self.size
+        heading = self.display.color_message(self.display.format_stats(self.stats), 'BOLD')
+
+        widths = self.display.task_table_layout(len(self.ids), term_width)
+        if widths != self.widths:
+            self.widths = widths
+            self.rows = {}
+        table = TableWriter(list(widths.values()), None)
+        table_width = TableWriter.table_width(widths.values())
+
+        if table_width > term_width:
+            return [heading, f'The task list has a width of {table_width} and cannot fit in the terminal of width {term_width}.']
+        if not self.shown:
+            return [heading, 'No tasks match the given filters.' if self.ids else 'You don\'t have any tasks yet.']
+
+        border = table.border.rstrip('\n')
+        lines = [heading, border]
+        lines.extend(table.row_lines([self.display.color_message(header, 'BOLD') for header in TASK_HEADERS]))
+        lines.append(border)
+
+        # Rows past the bottom of the screen aren't even formatted
+        table_start = len(lines)
+        row_ends = []
+        for task_id in self.shown:
+            if len(lines) >= term_height:
+                break
+            lines.extend(self.row_lines(task_id, table))
+            lines.append(border)
+            row_ends.append(len(lines))
+
+        if len(row_ends) == len(self.shown) and len(lines) <= term_height:
+            return lines
+
+        # Show the rows that fit with a line to spare for what didn't
+        fitting = bisect_right(row_ends, term_height - 1)
+        lines = lines[:row_ends[fitting - 1] if fitting else table_start]
+        lines.append(f'{len(self.shown) - fitting} more tasks below, make the terminal taller to see them')
+        return lines[:term_height]
+
+    def row_lines(self, task_id, table):
+        """ Returns the lines of a task's row, formatting it only if it's
+            changed or been renumbered since it was last formatted """
+        position = bisect_left(self.ids, task_id) + 1
+        row = self.rows.get(task_id)
+        if row is None or row[0] != position:
+            task = self.tasks[task_id]
+            task.position = position
+            row = (position, table.row_lines(self.display.format_row([task], self.widths)[0]))
+            self.rows[task_id] = row
+        return row[1]
+
+    def draw(self, lines):
+        """ Rewrites the lines that differ from what's on screen """
+        output = []
+        for index, line in enumerate(lines):
+            if index >= len(self.screen) or self.screen[index] != line:
+                output.append(move_to(index) + line + CLEAR_LINE)
+        if len(lines) < len(self.screen):
+            output.append(move_to(len(lines)) + CLEAR_BELOW)
+
+        self.screen = lines
+        if output:
+            sys.stdout.write(''.join(output))
+            sys.stdout.flush()